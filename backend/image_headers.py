@@ -0,0 +1,178 @@
+"""Reads image dimensions from file headers without decoding the image.
+
+Supports PNG, GIF, WebP and JPEG. The dimensions of most images are found in
+the first few hundred bytes, but JPEGs may store large EXIF/XMP segments before
+the frame header, so `read_dimensions` skips over those segments and fetches
+only the data at the start of the next one."""
+
+import struct
+
+# Bytes to read initially, which covers the headers of most images.
+INITIAL_READ_SIZE = 512
+# Give up looking for dimensions beyond this offset.
+MAX_READ_SIZE = 8 * 1024 * 1024
+# Upper bound for a single fetch (Blobstore allows fetching ~1MB at a time).
+MAX_FETCH_SIZE = 1000000
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+JPEG_SIGNATURE = b'\xff\xd8'
+GIF_SIGNATURES = (b'GIF87a', b'GIF89a')
+
+# JPEG start-of-frame markers, which contain the image dimensions.
+JPEG_SOF_MARKERS = frozenset(
+    [0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+     0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF])
+# JPEG markers without a length field.
+JPEG_STANDALONE_MARKERS = frozenset(
+    [0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8])
+
+
+class NeedMoreData(Exception):
+    """Raised when the header extends beyond the data read so far.
+    `required` is the offset in the file up to which data is needed and, for
+    JPEGs, `offset` is the offset of the segment being parsed."""
+
+    def __init__(self, required, offset=None):
+        super(NeedMoreData, self).__init__(required)
+        self.required = required
+        self.offset = offset
+
+
+def _require(data, length, base=0, offset=None):
+    if len(data) < length - base:
+        raise NeedMoreData(length, offset)
+
+
+def _get_png_dimensions(data):
+    _require(data, 24)
+    return struct.unpack('>II', data[16:24])
+
+
+def _get_gif_dimensions(data):
+    _require(data, 10)
+    return struct.unpack('<HH', data[6:10])
+
+
+def _get_webp_dimensions(data):
+    _require(data, 30)
+    chunk = data[12:16]
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L':
+        b0, b1, b2, b3 = bytearray(data[21:25])
+        width = 1 + (((b1 & 0x3F) << 8) | b0)
+        height = 1 + (((b3 & 0xF) << 10) | (b2 << 2) | ((b1 & 0xC0) >> 6))
+        return width, height
+    if chunk == b'VP8X':
+        width, = struct.unpack('<I', data[24:27] + b'\x00')
+        height, = struct.unpack('<I', data[27:30] + b'\x00')
+        return width + 1, height + 1
+    return None
+
+
+def _get_jpeg_dimensions(data, base=0):
+    """Parses the JPEG segments in `data`, which starts at offset `base` of
+    the file. `base` must be the offset of a segment."""
+    offset = base or 2
+    while True:
+        segment = offset
+        _require(data, offset + 4, base, segment)
+        i = offset - base
+        if data[i:i + 1] != b'\xff':
+            return None
+        # Markers may be padded with any number of 0xFF fill bytes.
+        while data[i + 1:i + 2] == b'\xff':
+            offset += 1
+            i += 1
+            _require(data, offset + 4, base, segment)
+        marker = bytearray(data[i + 1:i + 2])[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            offset += 2
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            _require(data, offset + 9, base, segment)
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return width, height
+        length, = struct.unpack('>H', data[i + 2:i + 4])
+        offset += 2 + length
+
+
+def get_dimensions(data):
+    """Returns a (width, height) tuple parsed from the start of an image file,
+    or None if the format isn't recognized. Raises `NeedMoreData` if `data`
+    ends before the dimensions."""
+    _require(data, 12)
+    if data.startswith(PNG_SIGNATURE):
+        return _get_png_dimensions(data)
+    if data.startswith(GIF_SIGNATURES):
+        return _get_gif_dimensions(data)
+    if data.startswith(b'RIFF') and data[8:12] == b'WEBP':
+        return _get_webp_dimensions(data)
+    if data.startswith(JPEG_SIGNATURE):
+        return _get_jpeg_dimensions(data)
+    return None
+
+
+def read_dimensions(fetch, initial_size=INITIAL_READ_SIZE,
+                    max_size=MAX_READ_SIZE):
+    """Returns the (width, height) of an image, or None if they couldn't be
+    found. `fetch(start, end)` must return the bytes between `start` and `end`
+    (inclusive), like `blobstore.fetch_data`."""
+    # `data` holds the bytes of the file from offset `base`.
+    base = 0
+    data = fetch(0, initial_size - 1)
+    requested = initial_size
+    while True:
+        try:
+            if base:
+                return _get_jpeg_dimensions(data, base)
+            return get_dimensions(data)
+        except NeedMoreData as e:
+            # The end of the file was reached.
+            if base + len(data) < requested:
+                return None
+            if e.offset is not None and e.offset > base:
+                # Skip to the next JPEG segment, without reading the rest of
+                # the current one.
+                if e.offset >= max_size:
+                    return None
+                base = e.offset
+                data = fetch(base, base + initial_size - 1)
+                requested = base + initial_size
+                continue
+            # Grow the read geometrically to limit the number of fetches.
+            end = min(max(e.required, base + len(data) * 2), max_size,
+                      base + len(data) + MAX_FETCH_SIZE)
+            if end <= base + len(data):
+                return None
+            data += fetch(base + len(data), end - 1)
+            requested = end
+
+
+class DimensionSniffer(object):
+    """Finds the dimensions of an image that is being streamed, buffering only
+    the start of the stream until its header has been parsed."""
+
+    def __init__(self, max_size=MAX_READ_SIZE):
+        self.dimensions = None
+        self._buffer = b''
+        self._done = False
+        self._max_size = max_size
+        self._required = 0
+
+    def feed(self, chunk):
+        if self._done:
+            return
+        self._buffer += chunk
+        if len(self._buffer) < self._required:
+            return
+        try:
+            self.dimensions = get_dimensions(self._buffer)
+            self._done = True
+        except NeedMoreData as e:
+            self._required = e.required
+            if e.required > self._max_size:
+                self._done = True
+        if self._done:
+            self._buffer = b''
@@ -0,0 +1,127 @@
+import struct
+import unittest
+
+import image_headers
+
+
+def png(width, height):
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    return (image_headers.PNG_SIGNATURE + struct.pack('>I', len(ihdr))
+            + b'IHDR' + ihdr + b'\x00' * 4)
+
+
+def gif(width, height):
+    return b'GIF89a' + struct.pack('<HH', width, height) + b'\x00' * 16
+
+
+def webp(chunk, payload):
+    body = b'WEBP' + chunk + struct.pack('<I', len(payload)) + payload
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+def webp_lossy(width, height):
+    # Frame tag, start code, then 14-bit dimensions with 2-bit scales.
+    payload = (b'\x30\x01\x00' + b'\x9d\x01\x2a'
+               + struct.pack('<HH', width | 0x4000, height | 0x8000))
+    return webp(b'VP8 ', payload + b'\x00' * 8)
+
+
+def webp_lossless(width, height):
+    bits = (width - 1) | ((height - 1) << 14)
+    return webp(b'VP8L', b'\x2f' + struct.pack('<I', bits) + b'\x00' * 8)
+
+
+def webp_extended(width, height):
+    payload = (b'\x08\x00\x00\x00' + struct.pack('<I', width - 1)[:3]
+               + struct.pack('<I', height - 1)[:3])
+    return webp(b'VP8X', payload + b'\x00' * 8)
+
+
+def jpeg_segment(marker, payload):
+    return b'\xff' + marker + struct.pack('>H', len(payload) + 2) + payload
+
+
+def jpeg(width, height, sof=b'\xc0', segments=()):
+    frame = struct.pack('>BHHB', 8, height, width, 3) + b'\x00' * 9
+    return (image_headers.JPEG_SIGNATURE
+            + jpeg_segment(b'\xe0', b'JFIF\x00' + b'\x00' * 9)
+            + b''.join(segments)
+            + jpeg_segment(b'\xdb', b'\x00' * 65)
+            + jpeg_segment(sof, frame)
+            + jpeg_segment(b'\xda', b'\x00' * 10) + b'\x00' * 64
+            + b'\xff\xd9')
+
+
+def exif(size):
+    return jpeg_segment(b'\xe1', b'Exif\x00\x00' + b'\x00' * (size - 6))
+
+
+class Fetcher(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.calls = []
+
+    def __call__(self, start, end):
+        self.calls.append((start, end))
+        return self.data[start:end + 1]
+
+    @property
+    def bytes_read(self):
+        return sum(len(self.data[start:end + 1]) for start, end in self.calls)
+
+
+class ImageHeadersTestCase(unittest.TestCase):
+
+    def assertDimensions(self, data, expected):
+        self.assertEqual(expected, image_headers.get_dimensions(data))
+        self.assertEqual(expected, image_headers.read_dimensions(Fetcher(data)))
+        sniffer = image_headers.DimensionSniffer()
+        for i in range(0, len(data), 100):
+            sniffer.feed(data[i:i + 100])
+        self.assertEqual(expected, sniffer.dimensions)
+
+    def test_png(self):
+        self.assertDimensions(png(1600, 900), (1600, 900))
+
+    def test_gif(self):
+        self.assertDimensions(gif(320, 240), (320, 240))
+
+    def test_webp(self):
+        self.assertDimensions(webp_lossy(1024, 768), (1024, 768))
+        self.assertDimensions(webp_lossless(16383, 1), (16383, 1))
+        self.assertDimensions(webp_extended(20000, 10000), (20000, 10000))
+
+    def test_jpeg(self):
+        self.assertDimensions(jpeg(800, 600), (800, 600))
+        self.assertDimensions(jpeg(800, 600, sof=b'\xc2'), (800, 600))
+        # Fill bytes before a marker.
+        data = jpeg(800, 600).replace(b'\xff\xdb', b'\xff\xff\xff\xdb')
+        self.assertDimensions(data, (800, 600))
+
+    def test_jpeg_large_segments(self):
+        segments = [exif(60000), jpeg_segment(b'\xe2', b'\x00' * 65000),
+                    jpeg_segment(b'\xe2', b'\x00' * 65000)]
+        data = jpeg(4000, 3000, segments=segments)
+        self.assertDimensions(data, (4000, 3000))
+        # Only the start of each large segment is fetched.
+        fetch = Fetcher(data)
+        self.assertEqual((4000, 3000), image_headers.read_dimensions(fetch))
+        self.assertEqual(4, len(fetch.calls))
+        self.assertLessEqual(
+            fetch.bytes_read, 4 * image_headers.INITIAL_READ_SIZE)
+
+    def test_truncated(self):
+        data = jpeg(800, 600, segments=[exif(60000)])
+        self.assertIsNone(image_headers.read_dimensions(Fetcher(data[:30000])))
+        self.assertIsNone(image_headers.read_dimensions(Fetcher(png(1, 1)[:20])))
+        with self.assertRaises(image_headers.NeedMoreData):
+            image_headers.get_dimensions(data[:1000])
+
+    def test_unknown(self):
+        self.assertIsNone(image_headers.get_dimensions(b'<svg></svg>' + b' ' * 20))
+        self.assertIsNone(image_headers.read_dimensions(Fetcher(b'\x00' * 1000)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,23 +3,50 @@ vendor.add('lib')
 
 from google.appengine.api import app_identity
 from google.appengine.api import images
+from google.appengine.api import memcache
+from google.appengine.api import oauth
+from google.appengine.api import taskqueue
+from google.appengine.api import users
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import blobstore
 from google.appengine.ext import ndb
 from google.appengine.ext.webapp import blobstore_handlers
 from google.appengine.ext.webapp import template
 import cloudstorage as gcs
+import datetime
+import gzip
+import image_headers
+import io
 import json
 import logging
 import mimetypes
 import requests
 import os
-import uuid
+import re
 import webapp2
 
 
 APPID = app_identity.get_application_id()
 BUCKET_NAME = app_identity.get_default_gcs_bucket_name()
 FOLDER = 'grow-ext-cloud-images-uploads'
+SERVICE_ACCOUNT_EMAIL = '{}@appspot.gserviceaccount.com'.format(APPID)
+MAX_BATCH_SIZE = 200
+# Clients may store responses, but must revalidate them using the ETag.
+CACHE_CONTROL = 'no-cache'
+# Seconds to cache listings of an image's locale variants.
+VARIANTS_CACHE_TTL = 300
+# Bytes to read from an upload and write to GCS at a time.
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Set on every response so that clients can tell this backend apart from
+# older ones that ignore candidates. Keep in sync with
+# `google_cloud_images/headers.py`.
+VERSION_HEADER = 'X-Google-Cloud-Images-Version'
+BACKEND_VERSION = '2'
+# Objects to precompute serving data for per manifest build task.
+MANIFEST_BUILD_PAGE_SIZE = 100
+# Entries per page of the manifest endpoint.
+MANIFEST_PAGE_SIZE = 1000
+TASK_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
 
 SCOPE = [
     'https://www.googleapis.com/auth/cloud-platform',
@@ -48,11 +75,40 @@ gcs.set_default_retry_params(
                     max_retry_period=15))
 
 
+class ServingDataError(Exception):
+
+    def __init__(self, status, explanation, detail):
+        super(ServingDataError, self).__init__(detail)
+        self.status = status
+        self.explanation = explanation
+        self.detail = detail
+
+
 # TODO: Log uploaded images so they can be reset/deleted by path later.
 class UploadedImage(ndb.Model):
     path = ndb.StringProperty(repeated=True)
 
 
+class ServingData(ndb.Model):
+    """Memoized serving data for a GCS object, keyed by its `/gs/` path. An
+    entry is only valid while `etag` matches the object's current etag. ndb
+    also caches entities in memcache, so most lookups skip the datastore."""
+    etag = ndb.StringProperty(indexed=False)
+    payload = ndb.JsonProperty(compressed=True)
+    updated = ndb.DateTimeProperty(auto_now=True)
+    # When a manifest build last found the object.
+    scanned = ndb.DateTimeProperty(indexed=False)
+
+
+class Manifest(ndb.Model):
+    """The state of the manifest of a prefix, keyed by its `/gs/` path.
+    Objects scanned since `valid_since` (the start of the last completed
+    build) are included in the manifest."""
+    started = ndb.DateTimeProperty(indexed=False)
+    completed = ndb.DateTimeProperty(indexed=False)
+    valid_since = ndb.DateTimeProperty(indexed=False)
+
+
 class UploadCallbackHandler(blobstore_handlers.BlobstoreUploadHandler):
 
     def post(self):
@@ -96,23 +152,47 @@ class CreateUploadUrlHandler(webapp2.RequestHandler):
         self.response.out.write(resp)
 
 
+def get_upload_name(filename):
+    """Returns the name of an uploaded file without any directories, so
+    that uploads stay within the upload folder."""
+    return os.path.basename((filename or '').replace('\\', '/'))
+
+
 class UploadFileOnServerHandler(webapp2.RequestHandler):
+    """Uploads a file to GCS. The file may either be the `file` field of a
+    multipart form, or the raw request body (with the file's name provided in
+    the `filename` query parameter). Files are written to GCS in chunks. Raw
+    bodies are read from the request as they're written, whereas multipart
+    forms are parsed in full by webob first."""
 
     def post(self, bucket=None):
         bucket = bucket or BUCKET_NAME
         try:
-            uploaded_content = self.request.POST.multi['file'].file.read()
-            uploaded_name = self.request.POST.multi['file'].filename
-        except KeyError as e:
-            resp = json.dumps({
-                'error': str(e)
-            })
-            self.response.set_status(400)
-            self.response.headers['Content-Type'] = 'application/json'
-            self.response.out.write(resp)
+            if self.request.content_type.startswith('multipart/'):
+                uploaded_file = self.request.POST.multi['file']
+                uploaded_name = get_upload_name(uploaded_file.filename)
+                fp = uploaded_file.file
+            else:
+                uploaded_name = get_upload_name(self.request.GET['filename'])
+                fp = self.request.body_file
+        except (AttributeError, KeyError) as e:
+            self.write_json({'error': str(e)}, status=400)
             return
+        if not uploaded_name:
+            self.write_json({'error': 'A file name is required.'}, status=400)
+            return
+        self.write_json(self.upload(bucket, uploaded_name, fp))
+
+    def write_json(self, result, status=200):
+        self.response.set_status(status)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(json.dumps(result))
+
+    def upload(self, bucket, uploaded_name, fp, suffix=None):
+        """Streams the file-like `fp` to GCS and returns its serving data."""
         name, ext = os.path.splitext(uploaded_name)
-        hashed_name = '{}_{}{}'.format(name, os.getenv('REQUEST_ID_HASH'), ext)
+        hashed_name = '{}_{}{}{}'.format(
+            name, os.getenv('REQUEST_ID_HASH'), suffix or '', ext)
         gs_path = '/{}/{}/{}'.format(bucket, FOLDER, hashed_name)
         if hashed_name.endswith('.svg'):
             mimetype = 'image/svg+xml'
@@ -121,81 +201,212 @@ class UploadFileOnServerHandler(webapp2.RequestHandler):
         options = {
             'x-goog-acl': 'public-read',
         }
-        with gcs.open(gs_path, 'w', content_type=mimetype, options=options) as fp:
-            fp.write(uploaded_content)
+        is_image = gs_path.endswith(IMAGE_EXTENSIONS)
+        # Image headers are parsed as the file is written, instead of reading
+        # the file back afterwards.
+        sniffer = image_headers.DimensionSniffer() if is_image else None
+        with gcs.open(gs_path, 'w', content_type=mimetype, options=options) as out:
+            while True:
+                chunk = fp.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                out.write(chunk)
+                if sniffer:
+                    sniffer.feed(chunk)
         blob_key = blobstore.create_gs_key('/gs{}'.format(gs_path))
 
-        if gs_path.endswith(IMAGE_EXTENSIONS):
+        if is_image:
             serving_url = images.get_serving_url(blob_key, secure_url=True)
             result = {'url': serving_url}
-            try:
-                data = blobstore.fetch_data(blob_key, 0, 50000)
-                image = images.Image(image_data=data)
+            if sniffer.dimensions:
+                width, height = sniffer.dimensions
                 result.update({
                     'gs_path': gs_path,
-                    'height': image.height,
-                    'width': image.width,
+                    'height': height,
+                    'width': width,
                 })
-            except images.BadImageError:
-                # If the header containing sizes isn't in the first 50000 bytes of the image.
-                # Or, if the file uploaded was just not a real image.
-                logging.exception('Failed to transform image.')
+            else:
+                # If the file uploaded was just not a real image.
+                logging.error('Failed to read image dimensions -> {}'.format(gs_path))
         else:
             serving_url = 'https://storage.googleapis.com{}'.format(gs_path)
             result = {
                 'url': serving_url,
             }
-        resp = json.dumps(result)
-        self.response.headers['Content-Type'] = 'application/json'
-        self.response.out.write(resp)
+        return result
+
+
+class UploadFilesOnServerHandler(UploadFileOnServerHandler):
+    """Uploads every `file` field of a multipart form, responding with a JSON
+    array containing the serving data for each file in order."""
+
+    def post(self, bucket=None):
+        bucket = bucket or BUCKET_NAME
+        uploaded_files = self.request.POST.getall('file')
+        if not uploaded_files:
+            self.write_json({'error': 'No files were uploaded.'}, status=400)
+            return
+        # Fields without a file (e.g. text fields) are rejected before any
+        # file is uploaded.
+        for uploaded_file in uploaded_files:
+            if not get_upload_name(getattr(uploaded_file, 'filename', None)):
+                self.write_json({'error': 'Every "file" field must be a file.'},
+                                status=400)
+                return
+        results = []
+        for i, uploaded_file in enumerate(uploaded_files):
+            # Keeps names unique when the same file name is uploaded twice.
+            suffix = '_{}'.format(i) if i else None
+            results.append(self.upload(
+                bucket, get_upload_name(uploaded_file.filename),
+                uploaded_file.file, suffix=suffix))
+        self.write_json(results)
 
 
 class GetServingUrlHandler(webapp2.RequestHandler):
 
-    def normalize_gs_path(self, gs_path, locale):
+    def list_variants(self, prefix, reset_cache=False):
+        """Returns the set of paths of objects starting with `prefix`. The
+        listing is kept in memcache for a short time so that lookups of the
+        same image in many locales share one listing."""
+        cache_key = 'variants:{}'.format(prefix)
+        filenames = None if reset_cache else memcache.get(cache_key)
+        if filenames is None:
+            filenames = [stat.filename for stat in gcs.listbucket(prefix)
+                         if not stat.is_dir]
+            memcache.set(cache_key, filenames, time=VARIANTS_CACHE_TTL)
+        return set(filenames)
+
+    def normalize_gs_path(self, gs_path, locale, reset_cache=False):
         stat_result = None
         gs_path = '/gs/{}'.format(gs_path.lstrip('/'))
         if '{locale}' not in gs_path:
             stat_result = gcs.stat(gs_path[3:])
             return gs_path, stat_result
-	# Retrieve a localized image if it exists, otherwise strip the locale
-        # placeholder from the path and return the base image.
-        localized_gs_path = gs_path.replace('{locale}', locale)
-	try:
-            stat_result = gcs.stat(localized_gs_path[3:])
-            return localized_gs_path, stat_result
-	except (gcs.NotFoundError, gcs.ForbiddenError):
-            # If no file exists for the full locale identifier (language and
-            # territory), attempt retrieving a file for just the territory.
-            if '_' in locale:
-                language, territory = locale.split('_', 1)
-                localized_gs_path = \
-                        gs_path.replace('{locale}', '_{}'.format(territory))
+        # Retrieve a localized image if it exists, otherwise strip the locale
+        # placeholder from the path and return the base image. If no file
+        # exists for the full locale identifier (language and territory),
+        # attempt retrieving a file for just the territory.
+        candidates = [gs_path.replace('{locale}', locale)]
+        if '_' in locale:
+            language, territory = locale.split('_', 1)
+            candidates.append(gs_path.replace('{locale}', '_{}'.format(territory)))
+        candidates.append(gs_path.replace('@{locale}', ''))
+        if '@{locale}' not in gs_path:
+            for candidate in candidates:
                 try:
-                    stat_result = gcs.stat(localized_gs_path[3:])
-                    return localized_gs_path, stat_result
+                    return candidate, gcs.stat(candidate[3:])
                 except (gcs.NotFoundError, gcs.ForbiddenError):
                     pass
-        gs_path = gs_path.replace('@{locale}', '')
-        stat_result = gcs.stat(gs_path[3:])
-        return gs_path, stat_result
+            raise gcs.NotFoundError('No variant found for {}'.format(gs_path))
+        # All of the candidates share the part of the path before `@{locale}`,
+        # so a single listing finds whichever of them exist.
+        prefix = gs_path[3:gs_path.index('@{locale}')]
+        variants = self.list_variants(prefix, reset_cache=reset_cache)
+        for candidate in candidates:
+            if candidate[3:] not in variants:
+                continue
+            try:
+                # The listing may be stale, so confirm that the object still
+                # exists (which also avoids a stat when building the data).
+                return candidate, gcs.stat(candidate[3:])
+            except (gcs.NotFoundError, gcs.ForbiddenError):
+                memcache.delete('variants:{}'.format(prefix))
+        raise gcs.NotFoundError('No variant found for {}'.format(gs_path))
 
     def get(self, gs_path):
         gs_path = self.request.get('gs_path') or gs_path
         reset_cache = self.request.get('reset_cache')
         locale = self.request.get('locale')
-        service_account_email = \
-            '{}@appspot.gserviceaccount.com'.format(APPID)
+        # Clients may send fallback paths (e.g. alternative extensions and
+        # placeholders) to try in order if `gs_path` doesn't resolve.
+        candidates = [gs_path] + self.request.get_all('candidate')
         if not gs_path:
             detail = (
                 'Usage: Share GCS objects with `{}`. Make requests to:'
                 ' {}://{}/<bucket>/<path>.ext'.format(
-                    service_account_email,
+                    SERVICE_ACCOUNT_EMAIL,
                     os.getenv('wsgi.url_scheme'),
                     os.getenv('HTTP_HOST')))
             self.abort(400, detail=detail)
             return
-        gs_path, stat_result = self.normalize_gs_path(gs_path, locale)
+        for index, candidate in enumerate(candidates):
+            is_last = index == len(candidates) - 1
+            try:
+                candidate, stat_result = self.normalize_gs_path(
+                    candidate, locale, reset_cache=reset_cache)
+                self.response.headers['Cache-Control'] = CACHE_CONTROL
+                self.response.etag = stat_result.etag
+                # Clients revalidating their cached data only need to know
+                # whether the object has changed, which the stat already
+                # tells us.
+                if not reset_cache and stat_result.etag in self.request.if_none_match:
+                    self.response.status_int = 304
+                    return
+                result = self.build_serving_data(candidate, stat_result, reset_cache)
+                break
+            except ServingDataError as e:
+                if is_last:
+                    self.abort(e.status, explanation=e.explanation,
+                               detail=e.detail)
+                    return
+            except (gcs.NotFoundError, gcs.ForbiddenError) as e:
+                if is_last:
+                    # Respond with a 404 rather than a 500 so clients don't
+                    # retry.
+                    self.abort(404, explanation=e.__class__.__name__,
+                               detail=str(e))
+                    return
+        if len(candidates) > 1:
+            # The index of the candidate that resolved.
+            result['candidate'] = index
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(json.dumps(result))
+
+    def get_serving_data(self, gs_path, locale, reset_cache=False):
+        """Returns the serving data for a GCS object, raising
+        `ServingDataError` if the data could not be generated."""
+        gs_path, stat_result = self.normalize_gs_path(
+            gs_path, locale, reset_cache=reset_cache)
+        return self.build_serving_data(gs_path, stat_result, reset_cache)
+
+    def get_first_serving_data(self, gs_paths, locale, reset_cache=False):
+        """Returns `(index, data)` for the first of `gs_paths` whose serving
+        data can be generated, raising the error of the last one if none
+        can."""
+        for index, gs_path in enumerate(gs_paths):
+            try:
+                return index, self.get_serving_data(gs_path, locale, reset_cache)
+            except (ServingDataError, gcs.NotFoundError, gcs.ForbiddenError):
+                if index == len(gs_paths) - 1:
+                    raise
+
+    def build_serving_data(self, gs_path, stat_result, reset_cache=False,
+                           scanned=None):
+        key = ndb.Key(ServingData, gs_path)
+        payload = None
+        if reset_cache:
+            key.delete()
+        else:
+            memo = key.get()
+            if memo is not None and memo.etag == stat_result.etag:
+                payload = memo.payload
+                if scanned:
+                    memo.scanned = scanned
+                    memo.put()
+        if payload is None:
+            if stat_result.content_type is None:
+                # Stats from listings don't include the content type or metadata.
+                stat_result = gcs.stat(gs_path[3:])
+            payload = self._build_serving_data(gs_path, stat_result, reset_cache)
+            ServingData(key=key, etag=stat_result.etag, payload=payload,
+                        scanned=scanned).put()
+        # The path of the object that was actually resolved, which lets clients
+        # share data between locales that fall back to the same object.
+        payload['gs_path'] = gs_path[3:]
+        return payload
+
+    def _build_serving_data(self, gs_path, stat_result, reset_cache=False):
         bucket_path = gs_path[3:]  # bucket/path.mp4
 
         # Image-handling.
@@ -212,16 +423,14 @@ class GetServingUrlHandler(webapp2.RequestHandler):
                 detail = (
                     'Ensure the following service'
                     ' account has access to the object in Google Cloud Storage:'
-                    ' {}'.format(service_account_email))
-                self.abort(400, explanation='AccessDeniedError', detail=detail)
-                return
+                    ' {}'.format(SERVICE_ACCOUNT_EMAIL))
+                raise ServingDataError(400, 'AccessDeniedError', detail)
             except images.ObjectNotFoundError:
                 detail = (
                     'The object was not found. Ensure the following service'
                     ' account has access to the object in Google Cloud Storage:'
-                    ' {}'.format(service_account_email))
-                self.abort(400, explanation='ObjectNotFoundError', detail=detail)
-                return
+                    ' {}'.format(SERVICE_ACCOUNT_EMAIL))
+                raise ServingDataError(400, 'ObjectNotFoundError', detail)
             except images.TransformationError:
                 # A TransformationError may happen in several scenarios - if
                 # the file is simply too large for the images service to
@@ -244,23 +453,23 @@ class GetServingUrlHandler(webapp2.RequestHandler):
                     detail = (
                         'There was a problem transforming the image. Ensure the'
                         ' following service account has access to the object in Google'
-                        ' Cloud Storage: {}'.format(service_account_email))
-                    self.abort(400, explanation='TransformationError', detail=detail)
-                    return
+                        ' Cloud Storage: {}'.format(SERVICE_ACCOUNT_EMAIL))
+                    raise ServingDataError(400, 'TransformationError', detail)
 
             image_metadata = {}
-            try:
-                data = blobstore.fetch_data(blob_key, 0, 50000)
-                image = images.Image(image_data=data)
+            # Read only as much of the file as needed to find its dimensions.
+            dimensions = image_headers.read_dimensions(
+                lambda start, end: blobstore.fetch_data(blob_key, start, end))
+            if dimensions:
+                width, height = dimensions
                 image_metadata = {
-                        'height': image.height,
-                        'width': image.width,
+                        'height': height,
+                        'width': width,
                 }
-            except images.BadImageError:
-                # If the header containing sizes isn't in the first 50000 bytes of the image.
-                # Or, if the file uploaded was just not a real image.
-                logging.exception('Failed to transform image.')
-            response_content = json.dumps({
+            else:
+                # If the file uploaded was just not a real image.
+                logging.error('Failed to read image dimensions -> {}'.format(gs_path))
+            return {
                 'content_type': stat_result.content_type,
                 'created': stat_result.st_ctime,
                 'etag': stat_result.etag,
@@ -268,17 +477,20 @@ class GetServingUrlHandler(webapp2.RequestHandler):
                 'metadata': stat_result.metadata,
                 'size': stat_result.st_size,
                 'url': url,
-            })
+            }
 
         # Non-image (i.e. SVG, blob file) handling.
         else:
             video_metadata = {}
             ext = gs_path.split('.')[-1]  # mp4
             bucket = bucket_path.lstrip('/').split('/')[0]  # bucket
-            basename = str(uuid.uuid4())
+            # Derive the blob's name from the object's etag, so that repeat
+            # lookups find the existing blob and changed objects get a new one.
+            basename = re.sub(r'[^\w-]', '', stat_result.etag)
             blob_bucket_path = '/{}/blobs/{}.{}'.format(bucket, basename, ext)
             url = 'https://storage.googleapis.com{}'.format(blob_bucket_path)
             original_bucket_path = bucket_path
+            original_metadata = stat_result.metadata or {}
             if bucket_path.endswith('.svg'):
                 mimetype = 'image/svg+xml'
             else:
@@ -291,18 +503,18 @@ class GetServingUrlHandler(webapp2.RequestHandler):
             if mimetype:
                 metadata.update({'content-type': mimetype})
             try:
-                stat_result = gcs.stat(blob_bucket_path)
                 # Use the blob_bucket_path to support obfuscated mp4 files.
-                bucket_path = blob_bucket_path
+                stat_result = gcs.stat(blob_bucket_path)
             except gcs.NotFoundError:
                 # Copy file to blob path.
                 gcs.copy2(bucket_path, blob_bucket_path, metadata=metadata)
-                bucket_path = blob_bucket_path
             except gcs.ForbiddenError:
                 pass
-            # Also ensure the original item's metadata is updated.
-            gcs.copy2(original_bucket_path, original_bucket_path, metadata=metadata)
-            response_content = json.dumps({
+            # Also ensure the original item's metadata is updated, unless it
+            # already points to the blob.
+            if original_metadata.get('x-goog-meta-url') != url:
+                gcs.copy2(original_bucket_path, original_bucket_path, metadata=metadata)
+            return {
                 'content_type': stat_result.content_type,
                 'created': stat_result.st_ctime,
                 'etag': stat_result.etag,
@@ -310,10 +522,205 @@ class GetServingUrlHandler(webapp2.RequestHandler):
                 'metadata': stat_result.metadata,
                 'size': stat_result.st_size,
                 'url': url,
-            })
+            }
+
+
+class BatchHandler(GetServingUrlHandler):
+    """Generates serving data for many objects in a single request.
+
+    Accepts a JSON body like `{"items": [{"gs_path": ..., "locale": ...}]}`
+    and responds with `{"results": [...]}`, where each result contains either
+    the serving `data` or the `error` for the item at the same index. Items
+    may include a list of fallback `candidates`, in which case the data
+    includes the index of the `candidate` that resolved."""
+
+    def post(self):
+        try:
+            items = json.loads(self.request.body)['items']
+        except (ValueError, KeyError, TypeError) as e:
+            self.abort(400, detail='Invalid batch request: {}'.format(e))
+            return
+        if len(items) > MAX_BATCH_SIZE:
+            detail = 'Batch requests are limited to {} items.'
+            self.abort(400, detail=detail.format(MAX_BATCH_SIZE))
+            return
+        reset_cache = self.request.get('reset_cache')
+        results = []
+        for item in items:
+            gs_path = item.get('gs_path')
+            locale = item.get('locale')
+            try:
+                if not gs_path:
+                    raise ServingDataError(400, 'BadRequest', 'Missing gs_path.')
+                candidates = [gs_path] + (item.get('candidates') or [])
+                index, data = self.get_first_serving_data(
+                    candidates, locale, reset_cache)
+                if len(candidates) > 1:
+                    # Copied, since items resolving to the same object may
+                    # share the memoized payload.
+                    data = dict(data, candidate=index)
+                results.append({'data': data})
+            except ServingDataError as e:
+                results.append({'error': {
+                    'status': e.status,
+                    'explanation': e.explanation,
+                    'detail': e.detail,
+                }})
+            except (gcs.NotFoundError, gcs.ForbiddenError) as e:
+                results.append({'error': {
+                    'status': 404,
+                    'explanation': e.__class__.__name__,
+                    'detail': str(e),
+                }})
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(json.dumps({'results': results}))
+
+
+def is_current_user_admin():
+    """Whether the request is from an administrator of the app, either
+    signed in or using an OAuth access token."""
+    if users.is_current_user_admin():
+        return True
+    try:
+        return oauth.is_current_user_admin(SCOPE[0])
+    except oauth.Error:
+        return False
+
+
+def normalize_prefix(prefix):
+    return '/gs/{}'.format((prefix or '').lstrip('/'))
 
+
+class ManifestBuildHandler(GetServingUrlHandler):
+    """Starts building the manifest of a prefix, e.g. `?prefix=/bucket/folder/`.
+    Objects are listed and their serving data precomputed in pages, by a
+    chain of tasks. Builds may only be started by administrators, or by
+    App Engine cron jobs."""
+
+    def get(self):
+        # Cron jobs make GET requests. App Engine removes this header from
+        # external requests.
+        if self.request.headers.get('X-Appengine-Cron') != 'true':
+            self.abort(405)
+            return
+        self.start_build()
+
+    def post(self):
+        if not is_current_user_admin():
+            self.abort(403, detail='Only administrators may build manifests.')
+            return
+        self.start_build()
+
+    def start_build(self):
+        prefix = normalize_prefix(self.request.get('prefix'))
+        if prefix.count('/') < 3:
+            self.abort(400, detail='Usage: ?prefix=/<bucket>/<folder>/')
+            return
+        manifest = Manifest.get_by_id(prefix) or Manifest(id=prefix)
+        manifest.started = datetime.datetime.utcnow()
+        manifest.completed = None
+        manifest.put()
+        taskqueue.add(url='/_api/manifest/task', params={
+            'prefix': prefix,
+            'started': manifest.started.strftime(TASK_DATETIME_FORMAT),
+        })
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(json.dumps({
+            'prefix': prefix[3:],
+            'started': manifest.started.isoformat(),
+        }))
+
+
+class ManifestTaskHandler(GetServingUrlHandler):
+    """Precomputes the serving data for one page of objects within a prefix,
+    then enqueues the task for the next page."""
+
+    def post(self):
+        if 'X-AppEngine-TaskName' not in self.request.headers:
+            self.abort(403)
+            return
+        prefix = self.request.get('prefix')
+        marker = self.request.get('marker') or None
+        started = datetime.datetime.strptime(
+            self.request.get('started'), TASK_DATETIME_FORMAT)
+        manifest = Manifest.get_by_id(prefix)
+        if manifest is None or manifest.started != started:
+            # A newer build of the same prefix has started.
+            return
+        count = 0
+        for stat in gcs.listbucket(prefix[3:], marker=marker,
+                                   max_keys=MANIFEST_BUILD_PAGE_SIZE):
+            count += 1
+            marker = stat.filename
+            if (stat.is_dir
+                    or not stat.filename.endswith(IMAGE_EXTENSIONS + BLOB_EXTENSIONS)
+                    or '/blobs/' in stat.filename):
+                continue
+            gs_path = '/gs{}'.format(stat.filename)
+            try:
+                self.build_serving_data(gs_path, stat, scanned=started)
+            except (ServingDataError, gcs.NotFoundError, gcs.ForbiddenError) as e:
+                logging.error('Failed to build serving data -> {} ({})'.format(
+                    gs_path, e))
+        if count == MANIFEST_BUILD_PAGE_SIZE:
+            taskqueue.add(url='/_api/manifest/task', params={
+                'prefix': prefix,
+                'started': self.request.get('started'),
+                'marker': marker,
+            })
+            return
+        manifest.completed = datetime.datetime.utcnow()
+        manifest.valid_since = started
+        manifest.put()
+        logging.info('Built manifest -> {}'.format(prefix))
+
+
+class ManifestHandler(webapp2.RequestHandler):
+    """Responds with the precomputed serving data of every object within a
+    prefix, e.g. `?prefix=/bucket/folder/`, in pages. Responses contain an
+    `entries` object mapping `/bucket/path` to serving data, and a `cursor`
+    to request the next page with (or `null` on the last page)."""
+
+    def get(self):
+        prefix = normalize_prefix(self.request.get('prefix'))
+        manifest = Manifest.get_by_id(prefix)
+        if manifest is None or manifest.valid_since is None:
+            detail = 'No manifest has been built for {}.'.format(prefix[3:])
+            self.abort(404, detail=detail)
+            return
+        cursor = None
+        if self.request.get('cursor'):
+            cursor = Cursor(urlsafe=self.request.get('cursor'))
+        # Keys sort lexicographically, so a key range selects the prefix.
+        query = ServingData.query(
+            ServingData.key >= ndb.Key(ServingData, prefix),
+            ServingData.key < ndb.Key(ServingData, prefix + u'\ufffd'))
+        entities, next_cursor, more = query.fetch_page(
+            MANIFEST_PAGE_SIZE, start_cursor=cursor)
+        entries = {}
+        for entity in entities:
+            # Skips objects that weren't found by the last build, which may
+            # have been deleted.
+            if entity.scanned is None or entity.scanned < manifest.valid_since:
+                continue
+            payload = dict(entity.payload)
+            payload['gs_path'] = entity.key.id()[3:]
+            entries[payload['gs_path']] = payload
+        body = json.dumps({
+            'prefix': prefix[3:],
+            'completed': manifest.completed and manifest.completed.isoformat(),
+            'entries': entries,
+            'cursor': next_cursor.urlsafe() if more and next_cursor else None,
+        }, separators=(',', ':'))
+        self.response.headers['Cache-Control'] = CACHE_CONTROL
         self.response.headers['Content-Type'] = 'application/json'
-        self.response.out.write(response_content)
+        if 'gzip' in self.request.headers.get('Accept-Encoding', ''):
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as fp:
+                fp.write(body)
+            body = buf.getvalue()
+            self.response.headers['Content-Encoding'] = 'gzip'
+        self.response.out.write(body)
 
 
 def CorsMiddleware(app):
@@ -335,6 +742,10 @@ def CorsMiddleware(app):
             all_headers = [key.lower() for key, val in headers]
             if 'access-control-allow-origin' not in all_headers:
                 headers = _set_headers(headers)
+            if VERSION_HEADER.lower() not in all_headers:
+                # Identifies this version of the backend on every response,
+                # including errors, so that clients retry its server errors.
+                headers.append((VERSION_HEADER, BACKEND_VERSION))
             return start_response(status, headers, *args, **kwargs)
         return app(environ, headers_start_response)
 
@@ -349,5 +760,11 @@ app = CorsMiddleware(webapp2.WSGIApplication([
   ('/_api/create_upload_url', CreateUploadUrlHandler),
   ('/_api/upload_file/(.*)', UploadFileOnServerHandler),
   ('/_api/upload_file', UploadFileOnServerHandler),
+  ('/_api/upload_files/(.*)', UploadFilesOnServerHandler),
+  ('/_api/upload_files', UploadFilesOnServerHandler),
+  ('/_api/batch', BatchHandler),
+  ('/_api/manifest/build', ManifestBuildHandler),
+  ('/_api/manifest/task', ManifestTaskHandler),
+  ('/_api/manifest', ManifestHandler),
   ('/(.*)', GetServingUrlHandler),
 ]))
\ No newline at end of file
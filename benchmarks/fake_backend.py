@@ -0,0 +1,207 @@
+"""A local stand-in for the backend microservice, for benchmarking.
+
+Speaks the same JSON contract as `GetServingUrlHandler` (including `{locale}`
+fallback, candidates, ETag revalidation and the `/_api/batch` and
+`/_api/manifest` endpoints) for a synthetic set of objects held in memory, with configurable latency and error
+rate."""
+
+import hashlib
+import json
+import random
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+# See `VERSION_HEADER` in the backend.
+VERSION_HEADER = 'X-Google-Cloud-Images-Version'
+BACKEND_VERSION = '2'
+
+
+class FakeStorage(object):
+    """Synthetic objects, keyed by `/bucket/path`."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.objects = {}
+
+    def add(self, path, version=0):
+        etag = hashlib.md5('{}:{}'.format(path, version).encode('utf-8')).hexdigest()
+        with self._lock:
+            self.objects[path] = etag
+
+    def touch(self, path):
+        """Changes the etag of an object, as if it had been re-uploaded."""
+        with self._lock:
+            etag = self.objects[path]
+        self.add(path, version=etag)
+
+    def normalize(self, gs_path, locale):
+        """Mirrors `GetServingUrlHandler.normalize_gs_path`."""
+        gs_path = '/{}'.format(gs_path.lstrip('/'))
+        candidates = [gs_path]
+        if '{locale}' in gs_path:
+            candidates = [gs_path.replace('{locale}', locale or '')]
+            if locale and '_' in locale:
+                territory = locale.split('_', 1)[1]
+                candidates.append(gs_path.replace('{locale}', '_{}'.format(territory)))
+            candidates.append(gs_path.replace('@{locale}', ''))
+        for candidate in candidates:
+            if candidate in self.objects:
+                return candidate, self.objects[candidate]
+        return None, None
+
+    def resolve(self, candidates, locale):
+        """Returns `(index, path, etag)` for the first of `candidates` that
+        exists."""
+        for index, candidate in enumerate(candidates):
+            path, etag = self.normalize(candidate, locale)
+            if path is not None:
+                return index, path, etag
+        return None, None, None
+
+    def serving_data(self, path, etag):
+        return {
+            'content_type': 'image/jpeg',
+            'created': 1500000000.0,
+            'etag': etag,
+            'gs_path': path,
+            'image_metadata': {'height': 1080, 'width': 1920},
+            'metadata': {},
+            'size': 250000,
+            'url': 'https://lh3.googleusercontent.com/fake-{}'.format(etag),
+        }
+
+
+class FakeBackendHandler(BaseHTTPRequestHandler):
+    manifest_page_size = 1000
+    # Sent in `VERSION_HEADER`. Backends deployed before candidates were
+    # supported don't send it.
+    version = BACKEND_VERSION
+
+    def log_message(self, *args):
+        pass
+
+    def _simulate(self):
+        server = self.server
+        server.count_request()
+        time.sleep(max(0, random.gauss(server.latency, server.latency / 4)))
+        if server.error_rate and random.random() < server.error_rate:
+            self._write(500, {'error': 'Simulated error.'})
+            return False
+        return True
+
+    def _write(self, status, payload=None, headers=None):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        self.send_response(status)
+        headers = headers or {}
+        # Like the backend, identifies its version on every response.
+        if self.version:
+            headers.setdefault(VERSION_HEADER, self.version)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if payload is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if not self._simulate():
+            return
+        query = parse_qs(urlparse(self.path).query)
+        if urlparse(self.path).path == '/_api/manifest':
+            self._write_manifest(query)
+            return
+        gs_path = query.get('gs_path', [None])[0]
+        locale = query.get('locale', [None])[0]
+        if not gs_path:
+            self._write(400, {'error': 'Missing gs_path.'})
+            return
+        candidates = [gs_path] + query.get('candidate', [])
+        index, path, etag = self.server.storage.resolve(candidates, locale)
+        if path is None:
+            self._write(404, {'error': 'Not found.'})
+            return
+        headers = {'ETag': '"{}"'.format(etag), 'Cache-Control': 'no-cache'}
+        if etag in self.headers.get('If-None-Match', ''):
+            self._write(304, headers=headers)
+            return
+        data = self.server.storage.serving_data(path, etag)
+        if len(candidates) > 1:
+            data['candidate'] = index
+        self._write(200, data, headers)
+
+    def _write_manifest(self, query):
+        storage = self.server.storage
+        prefix = '/{}'.format(query.get('prefix', [''])[0].lstrip('/'))
+        start = int(query.get('cursor', [0])[0])
+        paths = sorted(path for path in storage.objects if path.startswith(prefix))
+        end = start + self.manifest_page_size
+        entries = dict((path, storage.serving_data(path, storage.objects[path]))
+                       for path in paths[start:end])
+        self._write(200, {
+            'prefix': prefix,
+            'entries': entries,
+            'cursor': str(end) if end < len(paths) else None,
+        })
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/_api/batch':
+            self._write(404, {'error': 'Not found.'})
+            return
+        if not self._simulate():
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        items = json.loads(self.rfile.read(length).decode('utf-8'))['items']
+        results = []
+        for item in items:
+            candidates = [item['gs_path']] + (item.get('candidates') or [])
+            index, path, etag = self.server.storage.resolve(
+                candidates, item.get('locale'))
+            if path is None:
+                results.append({'error': {'status': 404, 'detail': 'Not found.'}})
+                continue
+            data = self.server.storage.serving_data(path, etag)
+            if len(candidates) > 1:
+                data['candidate'] = index
+            results.append({'data': data})
+        self._write(200, {'results': results})
+
+
+class FakeBackend(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, storage, latency=0.05, error_rate=0.0, port=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), FakeBackendHandler)
+        self.storage = storage
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
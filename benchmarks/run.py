@@ -0,0 +1,244 @@
+"""Benchmarks image resolution against a local fake backend.
+
+Drives a synthetic pod of N images x M locales through `GoogleImage` and
+reports cold-build, warm-build and incremental (revalidation) throughput, as
+well as the load time, size and memory of the cache.
+
+Usage: python benchmarks/run.py --images 300 --locales 12 --latency 0.05
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+
+from google_cloud_images import cache_store
+from google_cloud_images import google_cloud_images as gci
+import fake_backend
+
+BUCKET = 'bench'
+LOCALES = ['en_US', 'de_DE', 'fr_FR', 'es_ES', 'it_IT', 'ja_JP', 'ko_KR',
+           'pt_BR', 'en_GB', 'en_AU', 'fr_CA', 'es_MX', 'nl_NL', 'sv_SE',
+           'pl_PL', 'tr_TR', 'ru_RU', 'zh_CN', 'zh_TW', 'hi_IN']
+
+
+class ObjectCache(object):
+    """An in-memory equivalent of Grow's object cache."""
+
+    def __init__(self, cache=None):
+        self._cache = cache or {}
+
+    def add(self, key, value):
+        self._cache[key] = value
+
+    def add_all(self, key_to_cached):
+        self._cache.update(key_to_cached)
+
+    def export(self):
+        return self._cache
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def remove(self, key):
+        return self._cache.pop(key, None)
+
+    def reset(self):
+        self._cache = {}
+
+
+class PodCache(object):
+
+    def __init__(self):
+        self.object_cache = ObjectCache()
+
+    def get_object_cache(self, ident, write_to_file=False):
+        return self.object_cache
+
+
+class SyntheticPod(object):
+    """The subset of a Grow pod used by the extension."""
+
+    def __init__(self, root, paths, locales):
+        self.root = root
+        self.podcache = PodCache()
+        self.logger = logging.getLogger('benchmark')
+        self.config = None
+        self._locales = locales
+        template = '\n'.join(
+            "{{{{ google_image('{}').url() }}}}".format(path) for path in paths)
+        self._files = {'/views/': {'bench.html': template}}
+
+    def abs_path(self, pod_path):
+        return os.path.join(self.root, pod_path.lstrip('/'))
+
+    def list_dir(self, dir_path):
+        if dir_path not in self._files:
+            raise IOError(dir_path)
+        return list(self._files[dir_path])
+
+    def file_exists(self, pod_path):
+        return False
+
+    def list_locales(self):
+        return self._locales
+
+    def list_preprocessors(self):
+        # Like Grow, creates new instances each time.
+        return [gci.GoogleCloudImagesPreprocessor(self, self.config)]
+
+    def read_file(self, pod_path):
+        dir_path, basename = pod_path.rsplit('/', 1)
+        return self._files[dir_path + '/'][basename]
+
+
+def create_storage(num_images, locales, variant_ratio):
+    storage = fake_backend.FakeStorage()
+    for i in range(num_images):
+        storage.add('/{}/image-{}.jpg'.format(BUCKET, i))
+        for locale in locales:
+            if random.random() < variant_ratio:
+                storage.add('/{}/image-{}@{}.jpg'.format(BUCKET, i, locale))
+    return storage
+
+
+def create_preprocessor(pod, backend_url, options):
+    config = gci.GoogleCloudImagesPreprocessor.Config(
+        backend=backend_url,
+        prefetch=options.prefetch,
+        prefetch_workers=options.workers,
+        batch_size=options.batch_size,
+        cache_backend=options.cache_backend,
+        manifest_prefixes=options.manifest_prefixes)
+    pod.config = config
+    return pod.list_preprocessors()[0]
+
+
+def render(pod, paths, locales):
+    """Accesses every image the way templates do, and returns the number of
+    lookups that failed."""
+    preprocessor = gci._get_preprocessor(pod)
+    failures = 0
+    for locale in locales:
+        for path in paths:
+            image = preprocessor.get_image(path, locale=locale, original_locale=locale)
+            try:
+                image.url(['s500'])
+                image.width
+            except (gci.Error, requests.RequestException):
+                failures += 1
+    return failures
+
+
+def build(pod, backend_url, paths, locales, options, revalidate=False):
+    preprocessor = create_preprocessor(pod, backend_url, options)
+    start = time.time()
+    if revalidate:
+        preprocessor.revalidate(0)
+    preprocessor.run()
+    failures = render(pod, paths, locales)
+    return time.time() - start, failures
+
+
+def measure_cache(pod, options):
+    """Measures the size, load time and memory of the cache as Grow would
+    store it between builds."""
+    if options.cache_backend == 'sqlite':
+        path = pod.abs_path(gci.SQLITE_CACHE_PATH)
+        size = os.path.getsize(path)
+        start = time.time()
+        cache = cache_store.SqliteCache(path)
+        cache.get('missing')
+        return {'bytes': size, 'load_seconds': time.time() - start}
+    path = pod.abs_path('/.grow/object_cache.json')
+    with open(path, 'w') as fp:
+        json.dump(pod.podcache.object_cache.export(), fp)
+    size = os.path.getsize(path)
+    if tracemalloc:
+        tracemalloc.start()
+    start = time.time()
+    with open(path) as fp:
+        json.load(fp)
+    result = {'bytes': size, 'load_seconds': time.time() - start}
+    if tracemalloc:
+        result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--images', type=int, default=300)
+    parser.add_argument('--locales', type=int, default=12)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Mean backend latency, in seconds.')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of backend requests that fail with a 500.')
+    parser.add_argument('--variant-ratio', type=float, default=0.1,
+                        help='Fraction of locales with a localized variant.')
+    parser.add_argument('--changed-ratio', type=float, default=0.05,
+                        help='Fraction of objects changed before the incremental build.')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=0)
+    parser.add_argument('--no-prefetch', dest='prefetch', action='store_false')
+    parser.add_argument('--cache-backend', default='object_cache',
+                        choices=['object_cache', 'sqlite'])
+    parser.add_argument('--manifest', dest='manifest_prefixes',
+                        action='store_const', const=['/{}/'.format(BUCKET)],
+                        default=[], help='Seed the cache from the manifest.')
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    random.seed(options.seed)
+    locales = LOCALES[:options.locales]
+    paths = ['/{}/image-{}@{{locale}}.jpg'.format(BUCKET, i)
+             for i in range(options.images)]
+    storage = create_storage(options.images, locales, options.variant_ratio)
+    backend = fake_backend.FakeBackend(
+        storage, latency=options.latency, error_rate=options.error_rate).start()
+    root = tempfile.mkdtemp()
+    os.makedirs(os.path.join(root, '.grow'))
+    pod = SyntheticPod(root, paths, locales)
+    lookups = len(paths) * len(locales)
+    results = {'lookups': lookups}
+    try:
+        for name in ('cold', 'warm', 'incremental'):
+            if name == 'incremental':
+                for path in random.sample(sorted(storage.objects),
+                                          int(len(storage.objects) * options.changed_ratio)):
+                    storage.touch(path)
+            requests_before = backend.requests
+            seconds, failures = build(pod, backend.url, paths, locales, options,
+                                      revalidate=(name == 'incremental'))
+            results[name] = {
+                'seconds': round(seconds, 3),
+                'lookups_per_second': round(lookups / seconds, 1),
+                'backend_requests': backend.requests - requests_before,
+                'failures': failures,
+            }
+        results['cache'] = measure_cache(pod, options)
+    finally:
+        backend.stop()
+        shutil.rmtree(root)
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
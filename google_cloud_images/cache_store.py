@@ -0,0 +1,157 @@
+"""A sqlite-backed alternative to Grow's object cache.
+
+Grow's object cache loads the whole cache into memory at startup and rewrites
+it as a single JSON file. For pods with many images, `SqliteCache` instead
+reads entries lazily (one indexed lookup per key) and writes each entry
+incrementally. It implements the subset of the object cache interface used by
+this extension."""
+
+import json
+import os
+import sqlite3
+import threading
+
+# Only the fields read by the extension are stored.
+STORED_KEYS = frozenset([
+    '_alias',
+    '_expires',
+    '_fetched',
+    '_missing',
+    '_placeholder',
+    'content_type',
+    'created',
+    'etag',
+    'gs_path',
+    'size',
+    'url',
+])
+STORED_IMAGE_METADATA_KEYS = frozenset(['height', 'width'])
+
+
+def compact(value):
+    """Returns a copy of a cache entry containing only the stored fields."""
+    entry = dict((key, val) for key, val in value.items() if key in STORED_KEYS)
+    if 'image_metadata' in value:
+        entry['image_metadata'] = dict(
+            (key, val) for key, val in value['image_metadata'].items()
+            if key in STORED_IMAGE_METADATA_KEYS)
+    return entry
+
+
+class SqliteCache(object):
+
+    def __init__(self, path):
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self._lock = threading.Lock()
+        self._memo = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries'
+            ' (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._memo:
+                row = self._conn.execute(
+                    'SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+                self._memo[key] = json.loads(row[0]) if row else None
+            return self._memo[key]
+
+    def add(self, key, value):
+        self.add_all({key: value})
+
+    def add_all(self, key_to_cached):
+        rows = []
+        entries = {}
+        for key, value in key_to_cached.items():
+            entries[key] = compact(value)
+            rows.append((key, json.dumps(entries[key], separators=(',', ':'))))
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO entries (key, value) VALUES (?, ?)', rows)
+            self._conn.commit()
+            self._memo.update(entries)
+
+    def remove(self, key):
+        with self._lock:
+            self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self._conn.commit()
+            self._memo.pop(key, None)
+
+    def export(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT key, value FROM entries').fetchall()
+        return dict((key, json.loads(value)) for key, value in rows)
+
+    def is_empty(self):
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM entries LIMIT 1').fetchone()
+        return row is None
+
+    def migrate(self, object_cache):
+        """Copies the entries of a Grow object cache into this cache."""
+        entries = object_cache.export()
+        if entries:
+            self.add_all(entries)
+        return len(entries)
+
+
+class NullCache(object):
+    """A cache that stores nothing, for backends (such as the local backend)
+    that are fast enough to query every time."""
+
+    def get(self, key):
+        return None
+
+    def add(self, key, value):
+        pass
+
+    def add_all(self, key_to_cached):
+        pass
+
+    def remove(self, key):
+        pass
+
+    def export(self):
+        return {}
+
+
+class MemoryCache(object):
+    """Keeps the entries of another cache in memory, for long-running
+    processes such as the development server."""
+
+    def __init__(self, cache):
+        self._cache = cache
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+        value = self._cache.get(key)
+        with self._lock:
+            return self._entries.setdefault(key, value)
+
+    def add(self, key, value):
+        self._cache.add(key, value)
+        with self._lock:
+            self._entries[key] = value
+
+    def add_all(self, key_to_cached):
+        self._cache.add_all(key_to_cached)
+        with self._lock:
+            self._entries.update(key_to_cached)
+
+    def remove(self, key):
+        self._cache.remove(key)
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def export(self):
+        return self._cache.export()
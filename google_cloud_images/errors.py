@@ -0,0 +1,12 @@
+"""Errors raised by the extension."""
+
+
+class Error(Exception):
+
+    def __init__(self, message, status=None, missing=False):
+        super(Error, self).__init__(message)
+        # The status of the backend's response, if any.
+        self.status = status
+        # Whether the backend definitively found no object, in which case the
+        # failure is cached (rather than e.g. a server error).
+        self.missing = missing
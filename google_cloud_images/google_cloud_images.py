@@ -1,26 +1,98 @@
 from jinja2.ext import Extension
+from multiprocessing.pool import ThreadPool
 from protorpc import messages
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.exceptions import MaxRetryError
+from requests.packages.urllib3.util.retry import Retry
+from . import cache_store
+from .errors import Error
+from .headers import supports_candidates
+from . import local_backend
+from . import options as options_lib
+from . import snapshot
+from . import stats as stats_lib
+import atexit
+import contextlib
 import grow
 import os
 import jinja2
+import re
 import requests
+import threading
+import time
 
+try:
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from urlparse import parse_qs, urlparse
 
-class Error(Exception):
-    pass
 
+# Matches literal `google_image('/bucket/path.jpg', ...)` calls in templates.
+GOOGLE_IMAGE_CALL_RE = re.compile(
+    r'google_image\(\s*[\'"]([^\'"]+)[\'"]([^)]*)\)')
+FUZZY_EXTENSIONS_RE = re.compile(r'fuzzy_extensions\s*=\s*True')
+# Matches `/bucket/path.ext` strings in content files.
+CONTENT_PATH_RE = re.compile(
+    r'(/[\w.-]+/[^\s\'"]+\.(?:gif|jpeg|jpg|json|mp4|png|svg|webm|webp))\b')
 
-__preprocessor = None
+CACHE_IDENT = 'ext-google-cloud-images'
+SQLITE_CACHE_PATH = '/.grow/ext-google-cloud-images.sqlite'
+LOCAL_CACHE_DIR = '/.grow/ext-google-cloud-images-local/'
+
+TEMPLATE_DIRS = ('/views/', '/partials/')
+CONTENT_DIRS = ('/content/',)
+
+# Bookkeeping keys stored alongside the backend's data in the object cache.
+ALIAS_KEY = '_alias'
+EXPIRES_KEY = '_expires'
+FETCHED_KEY = '_fetched'
+MISSING_KEY = '_missing'
+PLACEHOLDER_KEY = '_placeholder'
+
+# Set by backends in the data of the candidate that resolved.
+CANDIDATE_KEY = 'candidate'
+
+# Content types of the format options used by `GoogleImage.picture`.
+FORMAT_CONTENT_TYPES = {
+    'rg': 'image/gif',
+    'rj': 'image/jpeg',
+    'rp': 'image/png',
+    'rw': 'image/webp',
+}
+
+# The most items the backend accepts per batch.
+MAX_BATCH_SIZE = 200
+
+RETRY_STATUSES = (500, 502, 503, 504)
+RETRY_METHODS = frozenset(['GET', 'POST'])
+
+
+# The preprocessor used by templates, keyed by the pod's root since Grow's
+# `Pod` isn't hashable. Grow creates new preprocessor instances each time they
+# are listed, so preprocessors register themselves when they run.
+_preprocessors = {}
 
 
 def _get_preprocessor(pod):
-    global __preprocessor
-    if __preprocessor:
-        return __preprocessor
-    for preprocessor in pod.list_preprocessors():
-        if preprocessor.KIND == GoogleCloudImagesPreprocessor.KIND:
-            __preprocessor = preprocessor
-            return preprocessor
+    preprocessor = _preprocessors.get(pod.root)
+    if preprocessor is not None:
+        return preprocessor
+    preprocessors = [preprocessor for preprocessor in pod.list_preprocessors()
+                     if preprocessor.KIND == GoogleCloudImagesPreprocessor.KIND]
+    # Prefer preprocessors that run with the build over ones that are only
+    # run on demand (such as one exporting a snapshot).
+    preprocessors.sort(key=lambda preprocessor: not preprocessor.autorun)
+    if preprocessors:
+        _preprocessors[pod.root] = preprocessors[0]
+        return preprocessors[0]
+
+
+def _register_preprocessor(preprocessor):
+    """Makes `preprocessor` the one used by templates for its pod, unless it
+    only runs on demand and another preprocessor is already registered."""
+    current = _preprocessors.get(preprocessor.pod.root)
+    if preprocessor.autorun or current is None or not current.autorun:
+        _preprocessors[preprocessor.pod.root] = preprocessor
 
 
 def get_placeholder(bucket_path, placeholders):
@@ -30,37 +102,226 @@ def get_placeholder(bucket_path, placeholders):
     return placeholders.get(ext)
 
 
-def get_image_serving_data(backend, bucket_path, locale=None, fuzzy_extensions=None, logger=None, placeholders=None, is_placeholder=False):
+def is_expired(entry):
+    expires = entry.get(EXPIRES_KEY)
+    return expires is not None and expires < time.time()
+
+
+class BackendRetry(Retry):
+    """Retries server errors, except for 500s from backends deployed before
+    candidates were supported, which respond with a 500 for missing
+    objects."""
+
+    def increment(self, method=None, url=None, response=None, error=None,
+                  _pool=None, _stacktrace=None):
+        if (response is not None and response.status == 500
+                and not supports_candidates(response.headers)):
+            # With `raise_on_status` disabled, the response is returned.
+            raise MaxRetryError(_pool, url, 'Not retrying a 500 from an older backend.')
+        return super(BackendRetry, self).increment(
+            method, url, response, error, _pool, _stacktrace)
+
+
+def create_retry(total, backoff_factor):
+    kwargs = {
+        'total': total,
+        'backoff_factor': backoff_factor,
+        'status_forcelist': RETRY_STATUSES,
+        'raise_on_status': False,
+    }
+    try:
+        return BackendRetry(allowed_methods=RETRY_METHODS, **kwargs)
+    except TypeError:
+        # Older versions of urllib3.
+        return BackendRetry(method_whitelist=RETRY_METHODS, **kwargs)
+
+
+def get_candidates(bucket_path, fuzzy_extensions=False, placeholders=None):
+    """Returns the `(bucket_path, is_placeholder)` candidates to try, in
+    order, for an image: the path itself, the path with the alternative
+    extension (when using fuzzy extensions) and the placeholder."""
+    candidates = [(bucket_path, False)]
+    base, ext = os.path.splitext(bucket_path)
+    if fuzzy_extensions and ext in ['.jpg', '.png']:
+        ext = '.jpg' if ext == '.png' else '.png'
+        candidates.append((base + ext, False))
+    if placeholders and ext in placeholders:
+        candidates.append((placeholders[ext], True))
+    return candidates
+
+
+def select_candidate(data, candidates, logger=None, stats=None):
+    """Returns `(data, is_placeholder)` for data the backend resolved from
+    one of `candidates`, without the index of the candidate."""
+    data = dict(data)
+    index = data.pop(CANDIDATE_KEY, 0)
+    bucket_path, is_placeholder = candidates[index]
+    if index and is_placeholder:
+        if logger:
+            logger.warning('Error with Google Cloud Images URL (using placeholder instead) -> {}'.format(candidates[0][0]))
+        if stats:
+            stats.increment('placeholder_fallbacks')
+    elif index:
+        if logger:
+            logger.info('Using fuzzy extension -> {}'.format(bucket_path))
+        if stats:
+            stats.increment('fuzzy_fallbacks')
+    return data, is_placeholder
+
+
+def get_image_serving_data(backend, bucket_path, locale=None, fuzzy_extensions=None, logger=None, placeholders=None, is_placeholder=False, session=None, timeout=None, stats=None):
     """Makes a request to the backend microservice capable of generating URLs
-    that use Google's image-serving infrastructure."""
+    that use Google's image-serving infrastructure. The backend tries the
+    fuzzy extension and placeholder candidates within the same request.
+    Returns `(data, use_cache)`."""
+    candidates = get_candidates(bucket_path, fuzzy_extensions, placeholders)
     params = {'gs_path': bucket_path}
+    if len(candidates) > 1:
+        params['candidate'] = [path for path, _ in candidates[1:]]
     if locale:
         params['locale'] = locale
-    resp = requests.get(backend, params)
+    resp = (session or requests).get(backend, params=params, timeout=timeout)
+    data = None
+    if resp.ok:
+        try:
+            data = resp.json()
+        except ValueError:
+            pass
+    if data is not None:
+        data, used_placeholder = select_candidate(
+            data, candidates, logger=logger, stats=stats)
+        return data, not (is_placeholder or used_placeholder)
+    if len(candidates) > 1 and not supports_candidates(resp.headers):
+        # Older backends ignore candidates, so try them one at a time.
+        return get_image_serving_data_sequential(
+            backend, bucket_path, locale=locale,
+            fuzzy_extensions=fuzzy_extensions, logger=logger,
+            placeholders=placeholders, is_placeholder=is_placeholder,
+            session=session, timeout=timeout, stats=stats)
+    status = resp.status_code
+    # Backends that support candidates respond with an error status below 500
+    # only once every candidate has failed.
+    missing = status == 404 or (supports_candidates(resp.headers) and status < 500)
+    if fuzzy_extensions and os.path.splitext(bucket_path)[1] not in ['.jpg', '.png']:
+        raise Error('Fuzzy extensions only supports .png and .jpg files.',
+                    status=status, missing=missing)
+    if placeholders and not candidates[-1][1]:
+        text = 'No placeholder found for GCS path -> {}'
+        raise Error(text.format(candidates[-1][0]), status=status, missing=missing)
+    text = 'An error occurred generating a Google Cloud Images URL for: {} ({})'
+    raise Error(text.format(bucket_path, status), status=status, missing=missing)
+
+
+def get_image_serving_data_sequential(backend, bucket_path, locale=None, fuzzy_extensions=None, logger=None, placeholders=None, is_placeholder=False, session=None, timeout=None, stats=None):
+    """Like `get_image_serving_data`, for backends that don't support
+    candidates. Each fallback costs another request."""
+    params = {'gs_path': bucket_path}
+    if locale:
+        params['locale'] = locale
+    resp = (session or requests).get(backend, params=params, timeout=timeout)
+    data = None
+    if resp.ok:
+        try:
+            data = resp.json()
+        except ValueError:
+            pass
+    if data is not None:
+        return data, not is_placeholder
+    if fuzzy_extensions:
+        base, original_ext = os.path.splitext(bucket_path)
+        if original_ext not in ['.jpg', '.png']:
+            raise Error('Fuzzy extensions only supports .png and .jpg files.',
+                        status=resp.status_code, missing=resp.status_code == 404)
+        new_ext = '.jpg' if original_ext == '.png' else '.png'
+        bucket_path = base + new_ext
+        if logger:
+            logger.info('Trying fuzzy extension -> {}'.format(bucket_path))
+        if stats:
+            stats.increment('fuzzy_fallbacks')
+        return get_image_serving_data_sequential(backend, bucket_path, locale=locale, fuzzy_extensions=False, logger=logger, placeholders=placeholders, session=session, timeout=timeout, stats=stats)
+    if placeholders:
+        if logger:
+            logger.warning('Error with Google Cloud Images URL (using placeholder instead) -> {}'.format(bucket_path))
+        placeholder_path = get_placeholder(bucket_path, placeholders)
+        if stats:
+            stats.increment('placeholder_fallbacks')
+        return get_image_serving_data_sequential(backend, placeholder_path, locale=locale, fuzzy_extensions=False, logger=logger, is_placeholder=True, session=session, timeout=timeout, stats=stats)
+    text = 'An error occurred generating a Google Cloud Images URL for: {} ({})'
+    raise Error(text.format(bucket_path, resp.status_code),
+                status=resp.status_code, missing=resp.status_code == 404)
+
+
+def get_image_serving_data_batch(backend, items, session=None, timeout=None):
+    """Requests the serving data for many `(bucket_path, locale, candidates)`
+    items in a single call to the backend's batch endpoint. Returns a list
+    containing the result (either `{'data': ...}` or `{'error': ...}`) for
+    each item, and whether the backend tried the candidates."""
+    url = '{}/_api/batch'.format(backend.rstrip('/'))
+    payload = {'items': [
+        {'gs_path': bucket_path, 'locale': locale, 'candidates': candidates}
+        for bucket_path, locale, candidates in items]}
+    resp = (session or requests).post(url, json=payload, timeout=timeout)
     try:
-        return resp.json(), not is_placeholder
-    except ValueError:
-        if fuzzy_extensions:
-            base, original_ext = os.path.splitext(bucket_path)
-            if original_ext not in ['.jpg', '.png']:
-                raise Error('Fuzzy extensions only supports .png and .jpg files.')
-            new_ext = '.jpg' if original_ext == '.png' else '.png'
-            bucket_path = base + new_ext
-            if logger:
-                logger.info('Trying fuzzy extension -> {}'.format(bucket_path))
-            return get_image_serving_data(backend, bucket_path, locale=locale, fuzzy_extensions=False, logger=logger, placeholders=placeholders)
-        if placeholders:
-            if logger:
-                logger.warning('Error with Google Cloud Images URL (using placeholder instead) -> {}'.format(bucket_path))
-            placeholder_path = get_placeholder(bucket_path, placeholders)
-            return get_image_serving_data(backend, placeholder_path, locale=locale, fuzzy_extensions=False, logger=logger, is_placeholder=True)
-        text = 'An error occurred generating a Google Cloud Images URL for: {}'
-        raise Error(text.format(bucket_path))
+        resp.raise_for_status()
+        results = resp.json()['results']
+    except (requests.HTTPError, ValueError, KeyError):
+        text = 'An error occurred requesting a batch of Google Cloud Images URLs from: {}'
+        raise Error(text.format(url), status=resp.status_code)
+    return results, supports_candidates(resp.headers)
+
+
+def get_manifest(backend, prefix, session=None, timeout=None):
+    """Returns a dict mapping `/bucket/path` to the serving data of every
+    object in the backend's manifest of `prefix`, requesting each page of the
+    manifest in turn."""
+    url = '{}/_api/manifest'.format(backend.rstrip('/'))
+    params = {'prefix': prefix}
+    entries = {}
+    while True:
+        resp = (session or requests).get(url, params=params, timeout=timeout)
+        try:
+            resp.raise_for_status()
+            page = resp.json()
+            entries.update(page['entries'])
+        except (requests.HTTPError, ValueError, KeyError):
+            text = 'An error occurred requesting the Google Cloud Images manifest for: {} ({})'
+            raise Error(text.format(prefix, resp.status_code))
+        if not page.get('cursor'):
+            return entries
+        params['cursor'] = page['cursor']
+
+
+def get_locale_candidates(bucket_path, locale):
+    """Returns the paths the backend tries, in order, for an image in
+    `locale`: the full locale, the territory, and the path without a
+    locale."""
+    if '{locale}' not in bucket_path:
+        return [bucket_path]
+    locale = str(locale) if locale else ''
+    candidates = [bucket_path.replace('{locale}', locale)]
+    if '_' in locale:
+        territory = locale.split('_', 1)[1]
+        candidates.append(bucket_path.replace('{locale}', '_{}'.format(territory)))
+    candidates.append(bucket_path.replace('@{locale}', ''))
+    return candidates
 
 
 class GoogleImage(object):
+    __slots__ = (
+        'pod',
+        'locale',
+        'original_locale',
+        'bucket_path',
+        '_base_url',
+        '_backend',
+        '_placeholders',
+        '_fuzzy_extensions',
+        '_cache',
+        '_preprocessor',
+        '__data',
+    )
 
-    def __init__(self, pod, bucket_path, locale=None, original_locale=None, fuzzy_extensions=False):
+    def __init__(self, pod, bucket_path, locale=None, original_locale=None, fuzzy_extensions=False, preprocessor=None):
         self.pod = pod
         self.locale = locale
         self.original_locale = original_locale
@@ -70,38 +331,49 @@ class GoogleImage(object):
         self._placeholders = None
         self._fuzzy_extensions = fuzzy_extensions
         self._cache = None
+        self._preprocessor = preprocessor
         self.__data = None
 
     def __repr__(self):
         return '<GoogleImage {}>'.format(self.bucket_path)
 
+    @property
+    def preprocessor(self):
+        """The preprocessor that created the image, whose configuration,
+        cache and session are used to resolve it."""
+        if self._preprocessor is None:
+            self._preprocessor = _get_preprocessor(self.pod)
+        return self._preprocessor
+
     @property
     def cache(self):
         if self._cache is None:
-            podcache = self.pod.podcache
-            ident = 'ext-google-cloud-images'
-            self._cache = podcache.get_object_cache(ident, write_to_file=True)
+            self._cache = self.preprocessor.cache
         return self._cache
 
     @property
     def placeholders(self):
         if self._placeholders is None:
-            preprocessor = _get_preprocessor(self.pod)
-            self._placeholders = preprocessor.extensions_to_placeholders()
+            self._placeholders = self.preprocessor.extensions_to_placeholders()
         return self._placeholders
 
     @property
     def backend(self):
         if self._backend is None:
-            preprocessor = _get_preprocessor(self.pod)
-            self._backend = preprocessor.config.backend
+            self._backend = self.preprocessor.backend
         return self._backend
 
     @property
     def _data(self):
         if self.__data is None:
-            image_serving_data = self.cache.get(self._cache_key)
+            preprocessor = self.preprocessor
+            stats = preprocessor.stats
+            image_serving_data = self._get_cached()
             if image_serving_data is not None:
+                if stats:
+                    stats.increment('cache_hits')
+                if image_serving_data.get(MISSING_KEY):
+                    raise Error(image_serving_data[MISSING_KEY], missing=True)
                 self.__data = image_serving_data
             else:
                 if self.locale and '{locale}' in self.bucket_path:
@@ -114,38 +386,87 @@ class GoogleImage(object):
                 else:
                     message = 'Generating Google Cloud Images data -> {}'
                     message = message.format(self.bucket_path)
+                if preprocessor.config.offline:
+                    text = 'Google Cloud Images data is not cached (offline mode) -> {}'
+                    raise Error(text.format(self.bucket_path))
                 self.pod.logger.info(message)
-                data, use_cache = get_image_serving_data(self.backend, self.bucket_path,
-                                              locale=self.locale,
-                                              fuzzy_extensions=self._fuzzy_extensions,
-                                              logger=self.pod.logger,
-                                              placeholders=self.placeholders)
-                if use_cache:
-                    self.cache.add(self._cache_key, data)
-                self.__data = data
+                start = time.time()
+                try:
+                    data, use_cache = get_image_serving_data(self.backend, self.bucket_path,
+                                                  locale=self.locale,
+                                                  fuzzy_extensions=self._fuzzy_extensions,
+                                                  logger=self.pod.logger,
+                                                  placeholders=self.placeholders,
+                                                  session=preprocessor.session,
+                                                  timeout=preprocessor.timeout,
+                                                  stats=stats)
+                except Error as e:
+                    if stats:
+                        stats.increment('errors')
+                    # Only definitive misses are cached, so that server errors
+                    # are retried by the next build.
+                    if e.missing:
+                        self._set_missing(str(e))
+                    raise
+                finally:
+                    if stats:
+                        stats.increment('cache_misses')
+                        stats.record_wait(time.time() - start)
+                self._set_data(data, is_placeholder=not use_cache)
         return self.__data
 
+    def _get_cached(self):
+        return self.preprocessor.get_cached(self._cache_key)
+
+    def _set_data(self, data, is_placeholder=False):
+        if not is_placeholder:
+            self.preprocessor.set_cached(self._cache_key, data)
+        else:
+            # Placeholders are cached for a limited time, so that the original
+            # path is tried again once the TTL expires.
+            ttl = self.preprocessor.config.negative_cache_ttl
+            if ttl:
+                entry = dict(data)
+                entry[PLACEHOLDER_KEY] = True
+                entry[EXPIRES_KEY] = time.time() + ttl
+                self.cache.add(self._cache_key, entry)
+        self.__data = data
+
+    def _set_missing(self, message):
+        self.preprocessor.set_missing(self._cache_key, message)
+
     @property
     def _cache_key(self):
         if '{locale}' in self.bucket_path:
             return '{}:{}:{}:metadata'.format(self.backend, self.bucket_path, self.locale)
         return '{}:{}:metadata'.format(self.backend, self.bucket_path)
 
+    def _value(self, func):
+        """Returns `func()`, or a token standing in for it when deferred
+        resolution is enabled and the image's data isn't available yet."""
+        if (self.__data is None and self.preprocessor.deferred
+                and self._get_cached() is None):
+            return _deferred_values.add(self, func)
+        return func()
+
+    def _get_base_url(self):
+        if self._base_url is None:
+            self._base_url = self._data['url']
+        return self._base_url
+
     @property
     def base_url(self):
         """Returns a URL corresponding to the image served by Google's
         image-serving infrastructure."""
-        if self._base_url is None:
-            self._base_url = self._data['url']
-        return self._base_url
+        return self._value(self._get_base_url)
 
     @property
     def content_type(self):
-        return self._data['content_type']
+        return self._value(lambda: self._data['content_type'])
 
     @property
     def created(self):
-        return self._data['created']
+        return self._value(lambda: self._data['created'])
 
     @property
     def dimensions(self):
@@ -153,24 +474,179 @@ class GoogleImage(object):
 
     @property
     def etag(self):
-        return self._data['etag']
+        return self._value(lambda: self._data['etag'])
 
     @property
     def height(self):
-        return self._data['image_metadata'].get('height')
+        return self._value(lambda: self._data['image_metadata'].get('height'))
+
+    def picture(self, widths, sizes=None, alt='', options=None,
+                formats=('rw', 'rj'), **attrs):
+        """Returns a `<picture>` element with a `<source>` for each of
+        `formats` (`rw`, `rj`, `rp` or `rg`), in order of preference, and an
+        `<img>` with the last format. Additional keyword arguments are added
+        to the `<img>` as attributes."""
+        self._check_widths(widths)
+        return self._value(lambda: self._get_picture(
+            widths, sizes, alt, options, formats, attrs))
+
+    def _get_picture(self, widths, sizes, alt, options, formats, attrs):
+        options = list(options or [])
+        widths = self._get_srcset_widths(widths)
+        sizes_attr = ''
+        if sizes:
+            sizes_attr = ' sizes="{}"'.format(jinja2.escape(sizes))
+        parts = ['<picture>']
+        for image_format in formats:
+            parts.append('<source type="{}" srcset="{}"{}>'.format(
+                FORMAT_CONTENT_TYPES[image_format],
+                self._get_srcset(widths, options + [image_format]),
+                sizes_attr))
+        img_options = options + [formats[-1]] if formats else options
+        img_attrs = [('src', self.url(img_options + ['w{}'.format(widths[-1])]))]
+        original_width = self._data['image_metadata'].get('width')
+        original_height = self._data['image_metadata'].get('height')
+        if original_width and original_height:
+            # Lets browsers reserve space for the image before it loads.
+            img_attrs.append(('width', widths[-1]))
+            img_attrs.append(('height', int(round(
+                float(original_height) * widths[-1] / original_width))))
+        img_attrs.append(('alt', alt))
+        img_attrs.extend(sorted(attrs.items()))
+        parts.append('<img {}>'.format(' '.join(
+            '{}="{}"'.format(name, jinja2.escape(value))
+            for name, value in img_attrs)))
+        parts.append('</picture>')
+        return jinja2.Markup(''.join(parts))
+
+    def srcset(self, widths, options=None):
+        """Returns the value of a `srcset` attribute, with a URL for each of
+        `widths` (in pixels) with a width descriptor. Widths larger than the
+        original image are replaced by the original width."""
+        self._check_widths(widths)
+        return self._value(lambda: self._get_srcset(
+            self._get_srcset_widths(widths), options))
+
+    def _check_widths(self, widths):
+        if not widths:
+            text = 'At least one width is required for Google Cloud Images srcset -> {}'
+            raise Error(text.format(self.bucket_path))
+
+    def _get_srcset_widths(self, widths):
+        widths = sorted(set(int(width) for width in widths))
+        original_width = self._data['image_metadata'].get('width')
+        if original_width and widths[-1] > original_width:
+            widths = [width for width in widths if width < original_width]
+            widths.append(original_width)
+        return widths
+
+    def _get_srcset(self, widths, options=None):
+        options = list(options or [])
+        if not self._data['image_metadata'].get('width'):
+            # Without the original width, prevent upscaling instead.
+            options.append('nu')
+        return ', '.join(
+            '{} {}w'.format(self.url(options + ['w{}'.format(width)]), width)
+            for width in widths)
 
     @property
     def size(self):
-        return self._data['size']
+        return self._value(lambda: self._data['size'])
 
     def url(self, options=None):
+        """Returns the URL of the image, with `options` validated and in
+        canonical order."""
         if not options:
             return self.base_url
-        return '{}={}'.format(self.base_url, '-'.join(options))
+        return '{}={}'.format(self.base_url, options_lib.compile_options(options))
 
     @property
     def width(self):
-        return self._data['image_metadata'].get('width')
+        return self._value(lambda: self._data['image_metadata'].get('width'))
+
+
+class DeferredValues(object):
+    """Values of `GoogleImage` objects that were deferred during rendering.
+    Each value is rendered as a unique token, which is replaced once the data
+    for every image on the page has been fetched concurrently."""
+
+    TOKEN_RE = re.compile(r'__gci_deferred_(\d+)__')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counter = 0
+        self._values = {}
+
+    def add(self, image, func):
+        with self._lock:
+            self._counter += 1
+            ident = self._counter
+            self._values[ident] = (image, func)
+        renders = getattr(self._local, 'renders', None)
+        if renders:
+            renders[-1].append(ident)
+        return '__gci_deferred_{}__'.format(ident)
+
+    @contextlib.contextmanager
+    def render(self):
+        """Tracks the values deferred while rendering a template, and discards
+        the ones that weren't replaced (e.g. when rendering raises) once it's
+        done, so they don't accumulate in the development server."""
+        if getattr(self._local, 'renders', None) is None:
+            self._local.renders = []
+        idents = []
+        self._local.renders.append(idents)
+        try:
+            yield
+        finally:
+            self._local.renders.pop()
+            with self._lock:
+                for ident in idents:
+                    self._values.pop(ident, None)
+
+    def replace(self, content):
+        ids = set(int(ident) for ident in self.TOKEN_RE.findall(content))
+        if not ids:
+            return content
+        with self._lock:
+            values = dict((ident, self._values.pop(ident)) for ident in ids
+                          if ident in self._values)
+        images = [image for image, _ in values.values()]
+        if images:
+            images[0].preprocessor.resolve(images)
+
+        def _replace(match):
+            ident = int(match.group(1))
+            if ident not in values:
+                return match.group(0)
+            _, func = values[ident]
+            return '{}'.format(func())
+
+        return self.TOKEN_RE.sub(_replace, content)
+
+
+_deferred_values = DeferredValues()
+
+
+class GoogleCloudImagesTemplateMixin(object):
+    """Tracks the page being rendered, and replaces the tokens of deferred
+    values in rendered templates."""
+
+    def render(self, *args, **kwargs):
+        context = dict(*args, **kwargs)
+        doc = context.get('doc')
+        page = None
+        if doc is not None:
+            page = '{} ({})'.format(doc.pod_path, doc.locale)
+        previous_page = stats_lib.get_page()
+        stats_lib.set_page(page)
+        try:
+            with _deferred_values.render():
+                content = super(GoogleCloudImagesTemplateMixin, self).render(*args, **kwargs)
+                return _deferred_values.replace(content)
+        finally:
+            stats_lib.set_page(previous_page)
 
 
 class GoogleCloudImagesExtension(Extension):
@@ -179,6 +655,13 @@ class GoogleCloudImagesExtension(Extension):
         super(GoogleCloudImagesExtension, self).__init__(environment)
         environment.globals['google_image'] = \
             GoogleCloudImagesExtension.create_google_image
+        environment.globals['google_images'] = \
+            GoogleCloudImagesExtension.create_google_images
+        template_class = environment.template_class
+        if not issubclass(template_class, GoogleCloudImagesTemplateMixin):
+            environment.template_class = type(
+                'GoogleCloudImagesTemplate',
+                (GoogleCloudImagesTemplateMixin, template_class), {})
 
     @staticmethod
     @jinja2.contextfunction
@@ -195,16 +678,25 @@ class GoogleCloudImagesExtension(Extension):
         # `es_PR` pages should use `en_US` assets.
         # Either pull the locale from a global rewrite from podspec, or pull
         # from a key `google_cloud_images_locale` on the document.
+        preprocessor = _get_preprocessor(pod)
         if 'google_cloud_images_locale' in doc.fields and doc.google_cloud_images_locale:
             locale = doc.google_cloud_images_locale
         else:
-            preprocessor = _get_preprocessor(doc.pod)
-            if preprocessor.config.rewrite_locales:
-                for rewrite_locales in preprocessor.config.rewrite_locales:
-                    if locale == rewrite_locales.rewrite:
-                        locale = rewrite_locales.to
-        return GoogleImage(pod, bucket_path, locale=locale, original_locale=doc.locale,
-                           fuzzy_extensions=fuzzy_extensions)
+            locale = preprocessor.rewrite_locale(locale)
+        return preprocessor.get_image(bucket_path, locale=locale, original_locale=doc.locale,
+                                      fuzzy_extensions=fuzzy_extensions)
+
+    @staticmethod
+    @jinja2.contextfunction
+    def create_google_images(ctx, bucket_paths, fuzzy_extensions=False):
+        """Returns a list of `GoogleImage` objects, fetching the data for any
+        uncached images concurrently."""
+        images = [GoogleCloudImagesExtension.create_google_image(
+                      ctx, bucket_path, fuzzy_extensions=fuzzy_extensions)
+                  for bucket_path in bucket_paths]
+        if images:
+            images[0].preprocessor.resolve(images)
+        return images
 
 
 class RewriteLocalesMessage(messages.Message):
@@ -220,16 +712,565 @@ class PlaceholderMessage(messages.Message):
 class GoogleCloudImagesPreprocessor(grow.Preprocessor):
     KIND = 'google_cloud_images'
     _extensions_to_placeholders = None
+    _cache = None
+    _images = None
+    _refresh_pool = None
+    _refreshing = None
+    _rewrite_map = None
+    _session = None
+    _stats = None
+    _report_registered = False
+    _lock = threading.Lock()
 
     class Config(messages.Message):
         backend = messages.StringField(1)
         rewrite_locales = messages.MessageField(RewriteLocalesMessage, 2, repeated=True)
         placeholders = messages.MessageField(PlaceholderMessage, 3, repeated=True)
+        prefetch = messages.BooleanField(4, default=True)
+        prefetch_workers = messages.IntegerField(5, default=8)
+        batch_size = messages.IntegerField(6, default=0)
+        connect_timeout = messages.FloatField(7, default=5.0)
+        read_timeout = messages.FloatField(8, default=30.0)
+        max_retries = messages.IntegerField(9, default=3)
+        retry_backoff = messages.FloatField(10, default=0.5)
+        negative_cache_ttl = messages.IntegerField(11, default=3600)
+        revalidate_after = messages.IntegerField(12, default=0)
+        deferred = messages.BooleanField(13, default=False)
+        cache_backend = messages.StringField(14, default='object_cache')
+        report = messages.StringField(15)
+        offline = messages.BooleanField(16, default=False)
+        import_snapshot = messages.StringField(17)
+        export_snapshot = messages.StringField(18)
+        local_root = messages.StringField(19)
+        local_port = messages.IntegerField(20, default=8089)
+        stale_while_revalidate = messages.IntegerField(21, default=0)
+        manifest_prefixes = messages.StringField(22, repeated=True)
 
     def run(self, *args, **kwargs):
-        text = 'Using Google Cloud images backend -> {}'
-        message = text.format(self.config.backend)
+        if self.config.local_root:
+            text = 'Using local Google Cloud images backend -> {} ({})'
+            message = text.format(self.config.local_root, self.backend)
+        else:
+            text = 'Using Google Cloud images backend -> {}'
+            message = text.format(self.config.backend)
         self.pod.logger.info(message)
+        # Grow creates new instances each time preprocessors are listed, so
+        # templates are pointed at the instance that ran.
+        _register_preprocessor(self)
+        # Images are shared for the duration of a build.
+        self._images = {}
+        if self.stats is not None and not self._report_registered:
+            self._report_registered = True
+            atexit.register(self.write_report)
+        if self.config.import_snapshot:
+            count = snapshot.import_snapshot(
+                self, self.pod.abs_path(self.config.import_snapshot))
+            text = 'Imported Google Cloud Images snapshot -> {} ({} entries)'
+            self.pod.logger.info(text.format(self.config.import_snapshot, count))
+        if self.config.offline:
+            self.check_offline()
+        else:
+            if self.config.manifest_prefixes and not self.config.local_root:
+                self.seed_from_manifests()
+            if self.config.revalidate_after:
+                self.revalidate(self.config.revalidate_after)
+            if self.config.prefetch:
+                self.prefetch()
+        if self.config.export_snapshot:
+            count = snapshot.export_snapshot(
+                self, self.referenced_images(),
+                self.pod.abs_path(self.config.export_snapshot))
+            text = 'Exported Google Cloud Images snapshot -> {} ({} entries)'
+            self.pod.logger.info(text.format(self.config.export_snapshot, count))
+
+    @property
+    def backend(self):
+        """The URL of the backend, which is the local image server when using
+        the local backend."""
+        if self.config.local_root:
+            return 'http://localhost:{}'.format(self.config.local_port)
+        return self.config.backend
+
+    @property
+    def cache(self):
+        with self._lock:
+            if self._cache is None and self.config.local_root:
+                # Local files are read every time, so changes are seen
+                # immediately.
+                self._cache = cache_store.NullCache()
+            elif self._cache is None:
+                podcache = self.pod.podcache
+                cache = podcache.get_object_cache(CACHE_IDENT, write_to_file=True)
+                if self.config.cache_backend == 'sqlite':
+                    cache = self._create_sqlite_cache(cache)
+                if self.config.stale_while_revalidate:
+                    cache = cache_store.MemoryCache(cache)
+                self._cache = cache
+        return self._cache
+
+    def _create_sqlite_cache(self, object_cache):
+        cache = cache_store.SqliteCache(self.pod.abs_path(SQLITE_CACHE_PATH))
+        if cache.is_empty():
+            count = cache.migrate(object_cache)
+            if count:
+                text = 'Migrated Google Cloud Images data to {} -> {} entries'
+                self.pod.logger.info(text.format(SQLITE_CACHE_PATH, count))
+                # Empty the object cache so it's no longer loaded and written.
+                object_cache.reset()
+        return cache
+
+    @property
+    def session(self):
+        """A `requests.Session` shared by all backend calls, which keeps
+        connections alive and retries connection errors and 5xx responses with
+        exponential backoff."""
+        with self._lock:
+            if self._session is None and self.config.local_root:
+                root = os.path.join(self.pod.root,
+                                    os.path.expanduser(self.config.local_root))
+                self._session = local_backend.create_session(
+                    root, self.pod.abs_path(LOCAL_CACHE_DIR),
+                    self.config.local_port)
+            elif self._session is None:
+                retry = create_retry(self.config.max_retries,
+                                     self.config.retry_backoff)
+                pool_size = max(self.config.prefetch_workers, 10)
+                adapter = HTTPAdapter(max_retries=retry,
+                                      pool_connections=pool_size,
+                                      pool_maxsize=pool_size)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                if self.stats is not None:
+                    session.hooks['response'].append(self._record_response)
+                self._session = session
+        return self._session
+
+    @property
+    def deferred(self):
+        """Whether values of uncached images are deferred while rendering."""
+        return bool(self.config.deferred)
+
+    @property
+    def stats(self):
+        """Statistics about image resolution, collected when a `report` path
+        is configured."""
+        if self._stats is None and self.config.report:
+            self._stats = stats_lib.Stats()
+        return self._stats
+
+    def write_report(self):
+        path = self.pod.abs_path(self.config.report)
+        self.stats.write(path)
+        self.pod.logger.info(self.stats.summary())
+        text = 'Wrote Google Cloud Images report -> {}'
+        self.pod.logger.info(text.format(self.config.report))
+
+    def _record_response(self, resp, *args, **kwargs):
+        retries = getattr(getattr(resp.raw, 'retries', None), 'history', None)
+        query = parse_qs(urlparse(resp.url).query)
+        path = query.get('gs_path', [resp.url])[0]
+        self.stats.record_call(path, resp.elapsed.total_seconds(),
+                               retries=len(retries or ()))
+
+    @property
+    def timeout(self):
+        return (self.config.connect_timeout, self.config.read_timeout)
+
+    @property
+    def rewrite_map(self):
+        """A dict mapping locales to the locale whose assets they use."""
+        if self._rewrite_map is None:
+            rewrite_map = {}
+            rules = self.config.rewrite_locales or []
+            for rule in rules:
+                # Rewrites are applied in order, so one rewrite may feed into
+                # another.
+                locale = rule.rewrite
+                for rewrite_locales in rules:
+                    if locale == rewrite_locales.rewrite:
+                        locale = rewrite_locales.to
+                rewrite_map[rule.rewrite] = locale
+            self._rewrite_map = rewrite_map
+        return self._rewrite_map
+
+    def rewrite_locale(self, locale):
+        if locale is None:
+            return locale
+        return self.rewrite_map.get(str(locale), locale)
+
+    def get_image(self, bucket_path, locale=None, original_locale=None,
+                  fuzzy_extensions=False):
+        """Returns a `GoogleImage`, reusing the instance created earlier in
+        the build for the same arguments."""
+        if self.config.stale_while_revalidate or self.config.local_root:
+            # Instances hold on to their data, so they aren't reused when the
+            # data may be refreshed in the background or local files change.
+            return GoogleImage(self.pod, bucket_path, locale=locale,
+                               original_locale=original_locale,
+                               fuzzy_extensions=fuzzy_extensions,
+                               preprocessor=self)
+        if self._images is None:
+            self._images = {}
+        key = (bucket_path, str(locale) if locale else None, bool(fuzzy_extensions))
+        image = self._images.get(key)
+        if image is None:
+            image = GoogleImage(self.pod, bucket_path, locale=locale,
+                                original_locale=original_locale,
+                                fuzzy_extensions=fuzzy_extensions,
+                                preprocessor=self)
+            image = self._images.setdefault(key, image)
+        return image
+
+    def _list_files(self, dirs):
+        for dir_path in dirs:
+            try:
+                paths = self.pod.list_dir(dir_path)
+            except (IOError, OSError):
+                continue
+            for path in paths:
+                yield os.path.join(dir_path, path.lstrip('/'))
+
+    def find_image_references(self):
+        """Returns a set of (bucket_path, fuzzy_extensions) tuples for every
+        image referenced by the pod's templates and content."""
+        references = set()
+        for pod_path in self._list_files(TEMPLATE_DIRS):
+            content = self.pod.read_file(pod_path)
+            for match in GOOGLE_IMAGE_CALL_RE.finditer(content):
+                bucket_path, rest = match.groups()
+                fuzzy_extensions = bool(FUZZY_EXTENSIONS_RE.search(rest))
+                references.add((bucket_path, fuzzy_extensions))
+        # Templates often pass paths from content (e.g.
+        # `google_image(doc.hero)`), so paths in content files are included,
+        # except for files within the pod itself (e.g. `/static/...`).
+        for pod_path in self._list_files(CONTENT_DIRS):
+            if not pod_path.endswith(('.yaml', '.yml')):
+                continue
+            content = self.pod.read_file(pod_path)
+            for bucket_path in CONTENT_PATH_RE.findall(content):
+                if not self.pod.file_exists(bucket_path):
+                    references.add((bucket_path, False))
+        return references
+
+    def referenced_images(self):
+        """Returns a `GoogleImage` for every image (and locale) referenced by
+        the pod's templates and content."""
+        locales = [str(locale) for locale in self.pod.list_locales()]
+        images = []
+        for bucket_path, fuzzy_extensions in sorted(self.find_image_references()):
+            if '{locale}' in bucket_path and locales:
+                for locale in locales:
+                    images.append(self.get_image(
+                        bucket_path, locale=self.rewrite_locale(locale),
+                        original_locale=locale, fuzzy_extensions=fuzzy_extensions))
+            else:
+                images.append(self.get_image(
+                    bucket_path, fuzzy_extensions=fuzzy_extensions))
+        return images
+
+    def prefetch(self):
+        """Resolves the data for every image referenced by the pod before
+        rendering, so that rendering only hits the object cache."""
+        self.resolve(self.referenced_images())
+
+    def seed_from_manifests(self):
+        """Seeds the cache from the backend's manifests of the configured
+        `manifest_prefixes`, when images within them are uncached. Images
+        that aren't in a manifest are resolved as usual."""
+        prefixes = tuple(self.config.manifest_prefixes)
+        images = [image for image in self.referenced_images()
+                  if image.bucket_path.startswith(prefixes)
+                  and image._get_cached() is None]
+        if not images:
+            return
+        entries = {}
+        for prefix in prefixes:
+            try:
+                entries.update(get_manifest(self.backend, prefix,
+                                            session=self.session,
+                                            timeout=self.timeout))
+            except (Error, requests.RequestException) as e:
+                text = 'Failed to seed Google Cloud Images data from the manifest ({})'
+                self.pod.logger.warning(text.format(e))
+        now = time.time()
+        cache_entries = {}
+        seeded = 0
+        # Only the referenced images are cached, each aliased to the variant
+        # the backend would resolve for its locale.
+        for image in images:
+            for candidate in get_locale_candidates(image.bucket_path, image.locale):
+                if candidate in entries:
+                    key = '{}:{}:metadata'.format(self.backend, candidate)
+                    entry = dict(entries[candidate])
+                    entry[FETCHED_KEY] = now
+                    cache_entries[key] = entry
+                    if key != image._cache_key:
+                        cache_entries[image._cache_key] = {
+                            ALIAS_KEY: key,
+                            FETCHED_KEY: now,
+                        }
+                    seeded += 1
+                    break
+        if cache_entries:
+            self.cache.add_all(cache_entries)
+        text = 'Seeded Google Cloud Images data from the manifest -> {} of {} images'
+        self.pod.logger.info(text.format(seeded, len(images)))
+
+    def check_offline(self):
+        """Raises an error listing every referenced image that is missing from
+        the cache, since it can't be fetched in offline mode."""
+        missing = set()
+        for image in self.referenced_images():
+            entry = image._get_cached()
+            if entry is None or entry.get(MISSING_KEY):
+                if '{locale}' in image.bucket_path:
+                    missing.add('{} ({})'.format(image.bucket_path, image.locale))
+                else:
+                    missing.add(image.bucket_path)
+        if missing:
+            text = '{} Google Cloud Images missing from the cache (offline mode):\n{}'
+            raise Error(text.format(len(missing), '\n'.join(sorted(missing))))
+
+    def resolve(self, images):
+        """Concurrently resolves the data for any uncached images."""
+        pending = {}
+        for image in images:
+            key = image._cache_key
+            if key not in pending and image._get_cached() is None:
+                pending[key] = image
+        if not pending:
+            return
+        text = 'Prefetching Google Cloud Images data -> {} images'
+        self.pod.logger.info(text.format(len(pending)))
+        start = time.time()
+        pending = list(pending.values())
+        batch_size = min(self.config.batch_size, MAX_BATCH_SIZE)
+        if batch_size:
+            batches = [pending[i:i + batch_size]
+                       for i in range(0, len(pending), batch_size)]
+            self._map(self._resolve_batch, batches)
+        else:
+            self._map(self._resolve_image, pending)
+        if self.stats:
+            self.stats.record_wait(time.time() - start)
+
+    def _map(self, func, items):
+        workers = max(1, min(self.config.prefetch_workers, len(items)))
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _resolve_batch(self, images):
+        candidates = [get_candidates(image.bucket_path, image._fuzzy_extensions,
+                                     image.placeholders) for image in images]
+        items = [(image.bucket_path, image.locale,
+                  [path for path, _ in image_candidates[1:]])
+                 for image, image_candidates in zip(images, candidates)]
+        try:
+            results, tried_candidates = get_image_serving_data_batch(
+                self.backend, items, session=self.session,
+                timeout=self.timeout)
+        except (Error, local_backend.Error, requests.RequestException) as e:
+            text = 'Failed to prefetch a batch of Google Cloud Images data ({})'
+            self.pod.logger.warning(text.format(e))
+            results = [{}] * len(images)
+            tried_candidates = False
+        for image, image_candidates, result in zip(images, candidates, results):
+            data = result.get('data')
+            status = (result.get('error') or {}).get('status')
+            if data is not None:
+                if self.stats:
+                    self.stats.increment('cache_misses')
+                data, is_placeholder = select_candidate(
+                    data, image_candidates, logger=self.pod.logger,
+                    stats=self.stats)
+                image._set_data(data, is_placeholder=is_placeholder)
+            elif tried_candidates and status and status < 500:
+                # Every candidate failed, so the image is definitively missing.
+                text = 'An error occurred generating a Google Cloud Images URL for: {} ({})'
+                image._set_missing(text.format(image.bucket_path, status))
+                if self.stats:
+                    self.stats.increment('cache_misses')
+                    self.stats.increment('errors')
+                text = 'Failed to prefetch Google Cloud Images data -> {} ({})'
+                self.pod.logger.warning(text.format(image.bucket_path, status))
+            else:
+                # Other failed items are resolved individually, which applies
+                # fuzzy extensions and placeholders with backends that ignore
+                # candidates in batches.
+                self._resolve_image(image)
+
+    def get_cached(self, key):
+        """Returns the unexpired cached data for `key`, following aliases.
+        In offline mode, expired entries (e.g. placeholders and misses from a
+        snapshot) are returned, since they can't be fetched again."""
+        entry = self.cache.get(key)
+        if entry is not None and self.config.stale_while_revalidate:
+            self._refresh_if_stale(key, entry)
+        if entry is not None and ALIAS_KEY in entry:
+            entry = self.cache.get(entry[ALIAS_KEY])
+        if entry is None or (is_expired(entry) and not self.config.offline):
+            return None
+        return entry
+
+    def set_cached(self, key, data):
+        """Caches `data` under the key of the object the backend resolved,
+        and caches an alias to it under `key` if that differs. This way, the
+        many locales (or fuzzy extensions) that fall back to the same object
+        share a single copy of its data."""
+        now = time.time()
+        entry = dict(data)
+        entry[FETCHED_KEY] = now
+        resolved_key = self._get_resolved_key(key, data)
+        if resolved_key != key:
+            self.cache.add(key, {ALIAS_KEY: resolved_key, FETCHED_KEY: now})
+        self.cache.add(resolved_key, entry)
+
+    def set_missing(self, key, message):
+        """Caches that the image for `key` is missing, for
+        `negative_cache_ttl` seconds."""
+        ttl = self.config.negative_cache_ttl
+        if ttl:
+            self.cache.add(key, {
+                MISSING_KEY: message,
+                EXPIRES_KEY: time.time() + ttl,
+            })
+
+    def _get_resolved_key(self, key, data):
+        if data.get('gs_path'):
+            return '{}:{}:metadata'.format(self.backend, data['gs_path'])
+        return key
+
+    def revalidate(self, max_age):
+        """Revalidates cached data older than `max_age` seconds using
+        conditional requests, so unchanged objects only cost a 304."""
+        now = time.time()
+        stale = []
+        for key, entry in self.cache.export().items():
+            item = self._get_stale_item(key, entry, max_age, now)
+            if item is not None:
+                stale.append(item)
+        if not stale:
+            return
+        text = 'Revalidating Google Cloud Images data -> {} images'
+        self.pod.logger.info(text.format(len(stale)))
+        # Aliases are revalidated first, as revalidating an alias also
+        # confirms the object it resolves to. Objects confirmed this way are
+        # not requested again.
+        aliases = [item for item in stale if ALIAS_KEY in item[3]]
+        confirmed = set()
+        if aliases:
+            confirmed.update(self._map(self._revalidate_entry, aliases))
+        objects = [item for item in stale
+                   if ALIAS_KEY not in item[3] and item[0] not in confirmed]
+        if objects:
+            self._map(self._revalidate_entry, objects)
+
+    def _get_stale_item(self, key, entry, max_age, now):
+        """Returns the item to revalidate for a cache entry older than
+        `max_age` seconds, or `None`."""
+        prefix = '{}:'.format(self.backend)
+        suffix = ':metadata'
+        if not key.startswith(prefix) or not key.endswith(suffix):
+            return None
+        # Failed lookups and placeholders expire on their own.
+        if EXPIRES_KEY in entry or now - entry.get(FETCHED_KEY, 0) < max_age:
+            return None
+        if ALIAS_KEY in entry:
+            target = self.cache.get(entry[ALIAS_KEY]) or {}
+            entry = {
+                'etag': target.get('etag'),
+                'gs_path': target.get('gs_path'),
+                ALIAS_KEY: entry[ALIAS_KEY],
+            }
+        bucket_path = key[len(prefix):-len(suffix)]
+        locale = None
+        if '{locale}' in bucket_path:
+            bucket_path, locale = bucket_path.rsplit(':', 1)
+        return (key, bucket_path, locale, entry)
+
+    def _refresh_if_stale(self, key, entry):
+        """Revalidates a cache entry on a background thread if it is older
+        than the `stale_while_revalidate` window. The stale entry continues to
+        be served in the meantime."""
+        if self.config.offline:
+            return
+        item = self._get_stale_item(
+            key, entry, self.config.stale_while_revalidate, time.time())
+        if item is None:
+            return
+        with self._lock:
+            if self._refreshing is None:
+                self._refreshing = set()
+                self._refresh_pool = ThreadPool(
+                    max(1, min(self.config.prefetch_workers, 4)))
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self._refresh_pool.apply_async(self._refresh_entry, (item,))
+
+    def _refresh_entry(self, item):
+        try:
+            self._revalidate_entry(item)
+        finally:
+            with self._lock:
+                self._refreshing.discard(item[0])
+
+    def _revalidate_entry(self, item):
+        """Revalidates a cache entry, and returns the key of the object
+        that is now known to be current, or `None`."""
+        key, bucket_path, locale, entry = item
+        params = {'gs_path': bucket_path}
+        if locale:
+            params['locale'] = locale
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = '"{}"'.format(entry['etag'])
+        try:
+            resp = self.session.get(self.backend, params=params,
+                                    headers=headers, timeout=self.timeout)
+            if resp.status_code == 304:
+                now = time.time()
+                resolved_key = entry.get(ALIAS_KEY, key)
+                for confirmed_key in set([key, resolved_key]):
+                    cached = self.cache.get(confirmed_key)
+                    if cached is not None:
+                        cached = dict(cached)
+                        cached[FETCHED_KEY] = now
+                        self.cache.add(confirmed_key, cached)
+                return resolved_key
+            if resp.ok:
+                data = resp.json()
+                self.set_cached(key, data)
+                text = 'Google Cloud Images data changed -> {}'
+                self.pod.logger.info(text.format(bucket_path))
+                return self._get_resolved_key(key, data)
+            # Entries resolved using a fuzzy extension are requested without
+            # their candidates, so a 404 for those is expected.
+            resolved_ext = os.path.splitext(entry.get('gs_path') or bucket_path)[1]
+            if (resp.status_code == 404
+                    and resolved_ext == os.path.splitext(bucket_path)[1]):
+                text = 'Google Cloud Images object no longer exists -> {}'
+                self.pod.logger.warning(text.format(bucket_path))
+                if self.config.negative_cache_ttl:
+                    self.set_missing(key, text.format(bucket_path))
+                else:
+                    self.cache.remove(key)
+        except (requests.RequestException, ValueError) as e:
+            text = 'Failed to revalidate Google Cloud Images data -> {} ({})'
+            self.pod.logger.warning(text.format(bucket_path, e))
+        return None
+
+    def _resolve_image(self, image):
+        try:
+            image._data
+        except (Error, requests.RequestException) as e:
+            text = 'Failed to prefetch Google Cloud Images data -> {} ({})'
+            self.pod.logger.warning(text.format(image.bucket_path, e))
 
     def extensions_to_placeholders(self):
         if self._extensions_to_placeholders is None:
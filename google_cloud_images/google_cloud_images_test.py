@@ -0,0 +1,457 @@
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import jinja2
+
+from google_cloud_images import google_cloud_images as gci
+from google_cloud_images import local_backend
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import fake_backend
+
+
+class ObjectCache(object):
+    """An in-memory equivalent of Grow's object cache."""
+
+    def __init__(self):
+        self._cache = {}
+
+    def add(self, key, value):
+        self._cache[key] = value
+
+    def add_all(self, key_to_cached):
+        self._cache.update(key_to_cached)
+
+    def export(self):
+        return self._cache
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def remove(self, key):
+        return self._cache.pop(key, None)
+
+    def reset(self):
+        self._cache = {}
+
+
+class PodCache(object):
+
+    def __init__(self):
+        self.object_cache = ObjectCache()
+
+    def get_object_cache(self, ident, write_to_file=False):
+        return self.object_cache
+
+
+class Pod(object):
+    """The subset of a Grow pod used by the extension. Like Grow, creates new
+    preprocessor instances each time they are listed."""
+
+    def __init__(self, root, files, configs, locales=()):
+        self.root = root
+        self.podcache = PodCache()
+        self.logger = logging.getLogger('google_cloud_images_test')
+        self._files = files
+        self._configs = configs
+        self._locales = locales
+
+    def abs_path(self, pod_path):
+        return os.path.join(self.root, pod_path.lstrip('/'))
+
+    def list_dir(self, dir_path):
+        # Like Grow, lists files recursively.
+        paths = [os.path.join(path[len(dir_path):], basename)
+                 for path, files in self._files.items()
+                 if path.startswith(dir_path) for basename in files]
+        if not paths:
+            raise IOError(dir_path)
+        return paths
+
+    def file_exists(self, pod_path):
+        dir_path, basename = pod_path.rsplit('/', 1)
+        return basename in self._files.get(dir_path + '/', {})
+
+    def list_locales(self):
+        return self._locales
+
+    def list_preprocessors(self):
+        return [gci.GoogleCloudImagesPreprocessor(self, config, **kwargs)
+                for config, kwargs in self._configs]
+
+    def read_file(self, pod_path):
+        dir_path, basename = pod_path.rsplit('/', 1)
+        return self._files[dir_path + '/'][basename]
+
+
+class NoBatchHandler(fake_backend.FakeBackendHandler):
+    """A backend deployed before the batch endpoint was added."""
+
+    def do_POST(self):
+        self.server.count_request()
+        self._write(404, {'error': 'Not found.'})
+
+
+class OlderBackendHandler(NoBatchHandler):
+    """A backend deployed before candidates were supported, which ignores
+    them and responds to missing objects with a 500."""
+    version = None
+
+    def do_GET(self):
+        self.server.count_request()
+        query = fake_backend.parse_qs(fake_backend.urlparse(self.path).query)
+        _, path, etag = self.server.storage.resolve(query['gs_path'], None)
+        if path is None:
+            self._write(500, {'error': 'Not found.'})
+            return
+        self._write(200, self.server.storage.serving_data(path, etag))
+
+
+class Doc(object):
+
+    def __init__(self, pod, locale=None):
+        self.pod = pod
+        self.locale = locale
+        self.fields = {}
+        self.pod_path = '/content/pages/index.yaml'
+
+
+class GoogleCloudImagesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.storage = fake_backend.FakeStorage()
+        self.backend = fake_backend.FakeBackend(self.storage, latency=0).start()
+        self.addCleanup(self.backend.stop)
+
+    def create_pod(self, files=None, configs=None, locales=(), **config):
+        """Returns a pod with a preprocessor for each of `configs`, which are
+        `(config_kwargs, preprocessor_kwargs)` tuples, or with a single
+        preprocessor configured with `config`."""
+        if configs is None:
+            configs = [(config, {})]
+        configs = [(self.create_config(**config_kwargs), kwargs)
+                   for config_kwargs, kwargs in configs]
+        pod = Pod(self.root, files or {}, configs, locales)
+        self.addCleanup(gci._preprocessors.pop, pod.root, None)
+        return pod
+
+    def create_config(self, **kwargs):
+        kwargs.setdefault('backend', self.backend.url)
+        kwargs.setdefault('max_retries', 0)
+        return gci.GoogleCloudImagesPreprocessor.Config(**kwargs)
+
+    def create_files(self, paths):
+        template = ''.join("{{{{ google_image('{}') }}}}".format(path)
+                           for path in paths)
+        return {'/views/': {'page.html': template}}
+
+    def build(self, pod):
+        """Runs a new preprocessor instance, as Grow does for each build."""
+        preprocessor = pod.list_preprocessors()[0]
+        preprocessor.run()
+        return preprocessor
+
+    def expire(self, pod):
+        """Expires cached misses and placeholder fallbacks."""
+        for entry in pod.podcache.object_cache.export().values():
+            if gci.EXPIRES_KEY in entry:
+                entry[gci.EXPIRES_KEY] = 1
+
+    def render(self, pod, source, locale=None):
+        env = jinja2.Environment(extensions=[gci.GoogleCloudImagesExtension])
+        return env.from_string(source).render(doc=Doc(pod, locale))
+
+    def test_run_and_render_with_new_instances(self):
+        self.storage.add('/bucket/a.jpg')
+        self.storage.add('/bucket/b.jpg')
+        files = {'/views/': {'page.html': "{{ google_image('/bucket/a.jpg').url() }}"}}
+        pod = self.create_pod(files, report='/report.json')
+        preprocessor = pod.list_preprocessors()[0]
+        # The report is written below instead of when the process exits.
+        preprocessor._report_registered = True
+        preprocessor.run()
+        self.assertEqual(1, self.backend.requests)
+
+        html = self.render(
+            pod, "{{ google_image('/bucket/a.jpg').url() }} "
+                 "{{ google_image('/bucket/b.jpg').url() }}")
+        a_url, b_url = html.split()
+        self.assertEqual(preprocessor.get_image('/bucket/a.jpg').base_url, a_url)
+        self.assertTrue(b_url.startswith('https://'))
+        # Only the image that wasn't prefetched is requested while rendering.
+        self.assertEqual(2, self.backend.requests)
+
+        preprocessor.write_report()
+        with open(pod.abs_path('/report.json')) as fp:
+            report = json.load(fp)
+        self.assertEqual(2, report['counters']['backend_calls'])
+        self.assertEqual(2, report['counters']['cache_misses'])
+        self.assertEqual('/content/pages/index.yaml (None)',
+                         report['slowest_pages'][0]['page'])
+
+    def test_batch(self):
+        paths = ['/bucket/{}.jpg'.format(i) for i in range(5)]
+        for path in paths[:4]:
+            self.storage.add(path)
+        pod = self.create_pod(self.create_files(paths), batch_size=2)
+        preprocessor = self.build(pod)
+        # Definitive misses aren't requested again individually.
+        self.assertEqual(3, self.backend.requests)
+        for path in paths[:4]:
+            self.assertTrue(preprocessor.get_image(path).url().startswith('https://'))
+        with self.assertRaises(gci.Error):
+            preprocessor.get_image(paths[4]).url()
+        self.assertEqual(3, self.backend.requests)
+
+    def test_batch_size_is_capped(self):
+        paths = ['/bucket/{}.jpg'.format(i) for i in range(gci.MAX_BATCH_SIZE + 50)]
+        for path in paths:
+            self.storage.add(path)
+        self.build(self.create_pod(self.create_files(paths), batch_size=1000))
+        self.assertEqual(2, self.backend.requests)
+
+    def test_batch_fallback(self):
+        self.backend.RequestHandlerClass = NoBatchHandler
+        paths = ['/bucket/{}.jpg'.format(i) for i in range(3)]
+        for path in paths:
+            self.storage.add(path)
+        pod = self.create_pod(self.create_files(paths), batch_size=10)
+        preprocessor = self.build(pod)
+        # The failed batch is followed by a request for each image.
+        self.assertEqual(4, self.backend.requests)
+        for path in paths:
+            self.assertTrue(preprocessor.get_image(path).url().startswith('https://'))
+        self.assertEqual(4, self.backend.requests)
+
+    def test_older_backend(self):
+        self.backend.RequestHandlerClass = OlderBackendHandler
+        self.storage.add('/bucket/placeholder.png')
+        placeholders = [gci.PlaceholderMessage(
+            extensions=['.png'], path='/bucket/placeholder.png')]
+        pod = self.create_pod(placeholders=placeholders, max_retries=3,
+                              retry_backoff=0.0)
+        preprocessor = pod.list_preprocessors()[0]
+        url = preprocessor.get_image('/bucket/a.png').url()
+        # Its 500 for the missing image isn't retried, and the placeholder is
+        # requested separately.
+        self.assertEqual(3, self.backend.requests)
+        self.storage.add('/bucket/a.png')
+        self.expire(pod)
+        preprocessor = pod.list_preprocessors()[0]
+        self.assertNotEqual(url, preprocessor.get_image('/bucket/a.png').url())
+
+    def test_negative_cache_ttl(self):
+        path = '/bucket/missing.jpg'
+        pod = self.create_pod(self.create_files([path]))
+        self.build(pod)
+        self.assertEqual(1, self.backend.requests)
+        # The miss is cached for the next build.
+        preprocessor = self.build(pod)
+        with self.assertRaises(gci.Error):
+            preprocessor.get_image(path).url()
+        self.assertEqual(1, self.backend.requests)
+        # Once the TTL has passed, the path is tried again.
+        self.storage.add(path)
+        self.expire(pod)
+        preprocessor = self.build(pod)
+        self.assertEqual(2, self.backend.requests)
+        self.assertTrue(preprocessor.get_image(path).url().startswith('https://'))
+
+    def test_placeholder_ttl(self):
+        self.storage.add('/bucket/placeholder.png')
+        placeholders = [gci.PlaceholderMessage(
+            extensions=['.png'], path='/bucket/placeholder.png')]
+        pod = self.create_pod(self.create_files(['/bucket/a.png']),
+                              placeholders=placeholders)
+        preprocessor = self.build(pod)
+        placeholder_url = preprocessor.get_image('/bucket/a.png').url()
+        # The original and the placeholder are tried in one request.
+        self.assertEqual(1, self.backend.requests)
+        preprocessor = self.build(pod)
+        self.assertEqual(placeholder_url, preprocessor.get_image('/bucket/a.png').url())
+        self.assertEqual(1, self.backend.requests)
+        self.storage.add('/bucket/a.png')
+        self.expire(pod)
+        preprocessor = self.build(pod)
+        self.assertEqual(2, self.backend.requests)
+        self.assertNotEqual(placeholder_url, preprocessor.get_image('/bucket/a.png').url())
+
+    def test_server_errors_are_not_cached(self):
+        self.storage.add('/bucket/a.jpg')
+        pod = self.create_pod(self.create_files(['/bucket/a.jpg']))
+        self.backend.error_rate = 1
+        self.build(pod)
+        self.assertEqual({}, pod.podcache.object_cache.export())
+        self.backend.error_rate = 0
+        preprocessor = self.build(pod)
+        self.assertTrue(preprocessor.get_image('/bucket/a.jpg').url().startswith('https://'))
+
+    def test_revalidate(self):
+        paths = ['/bucket/a.jpg', '/bucket/b.jpg', '/bucket/c.jpg']
+        for path in paths:
+            self.storage.add(path)
+        pod = self.create_pod(self.create_files(paths))
+        preprocessor = self.build(pod)
+        a_url, b_url = [preprocessor.get_image(path).url() for path in paths[:2]]
+        self.assertEqual(3, self.backend.requests)
+        self.storage.touch('/bucket/b.jpg')
+        del self.storage.objects['/bucket/c.jpg']
+        pod.list_preprocessors()[0].revalidate(0)
+        self.assertEqual(6, self.backend.requests)
+        preprocessor = self.build(pod)
+        self.assertEqual(a_url, preprocessor.get_image('/bucket/a.jpg').url())
+        self.assertNotEqual(b_url, preprocessor.get_image('/bucket/b.jpg').url())
+        with self.assertRaises(gci.Error):
+            preprocessor.get_image('/bucket/c.jpg').url()
+        self.assertEqual(6, self.backend.requests)
+
+    def test_revalidate_aliases(self):
+        self.storage.add('/bucket/hero.jpg')
+        pod = self.create_pod(self.create_files(['/bucket/hero@{locale}.jpg']),
+                              locales=['de_DE', 'fr_FR'])
+        self.build(pod)
+        self.assertEqual(2, self.backend.requests)
+        # The object both locales resolve to is confirmed by their requests.
+        pod.list_preprocessors()[0].revalidate(0)
+        self.assertEqual(4, self.backend.requests)
+        # Only entries older than the given age are revalidated.
+        pod.list_preprocessors()[0].revalidate(3600)
+        self.assertEqual(4, self.backend.requests)
+
+    def test_locales_share_the_resolved_object(self):
+        self.storage.add('/bucket/hero.jpg')
+        self.storage.add('/bucket/hero@de_DE.jpg')
+        path = '/bucket/hero@{locale}.jpg'
+        pod = self.create_pod(self.create_files([path]),
+                              locales=['de_DE', 'en_US', 'fr_FR'])
+        self.build(pod)
+        self.assertEqual(3, self.backend.requests)
+        entries = pod.podcache.object_cache.export()
+        # Each object's data is stored once, with an alias for each locale.
+        data = [key for key, entry in entries.items() if gci.ALIAS_KEY not in entry]
+        aliases = [key for key, entry in entries.items() if gci.ALIAS_KEY in entry]
+        self.assertEqual(2, len(data))
+        self.assertEqual(3, len(aliases))
+        # Later builds follow the aliases without requests.
+        self.build(pod)
+        source = "{{{{ google_image('{}').url() }}}}".format(path)
+        de_url = self.render(pod, source, locale='de_DE')
+        en_url = self.render(pod, source, locale='en_US')
+        self.assertEqual(en_url, self.render(pod, source, locale='fr_FR'))
+        self.assertNotEqual(de_url, en_url)
+        self.assertIn(self.storage.objects['/bucket/hero@de_DE.jpg'], de_url)
+        self.assertEqual(3, self.backend.requests)
+
+    def test_deferred(self):
+        self.storage.add('/bucket/a.jpg')
+        pod = self.create_pod(prefetch=False, deferred=True)
+        self.build(pod)
+        html = self.render(pod, "{{ google_image('/bucket/a.jpg').width }}")
+        self.assertEqual('1920', html)
+        # Values deferred by renders that fail are discarded.
+        values = len(gci._deferred_values._values)
+        with self.assertRaises(jinja2.UndefinedError):
+            self.render(pod, "{{ google_image('/bucket/b.jpg').width }}{{ fail() }}")
+        self.assertEqual(values, len(gci._deferred_values._values))
+
+    def test_stale_while_revalidate_without_deferred(self):
+        self.storage.add('/bucket/a.jpg')
+        pod = self.create_pod(prefetch=False, stale_while_revalidate=300)
+        self.build(pod)
+        html = self.render(
+            pod, "{% if google_image('/bucket/a.jpg').width > 100 %}wide{% endif %}")
+        self.assertEqual('wide', html)
+
+    @unittest.skipIf(local_backend.Image is None, 'Requires Pillow.')
+    def test_local_files_are_read_every_time(self):
+        path = os.path.join(self.root, 'local', 'bucket', 'a.png')
+        os.makedirs(os.path.dirname(path))
+        local_backend.Image.new('RGB', (20, 10)).save(path)
+        pod = self.create_pod(self.create_files(['/bucket/a.png']),
+                              local_root='local', local_port=0)
+        preprocessor = self.build(pod)
+        self.assertEqual(20, preprocessor.get_image('/bucket/a.png').width)
+        local_backend.Image.new('RGB', (40, 10)).save(path)
+        self.assertEqual(40, preprocessor.get_image('/bucket/a.png').width)
+
+    def test_templates_use_the_preprocessor_that_ran(self):
+        pod = self.create_pod(configs=[
+            ({'export_snapshot': '/snapshot.json'},
+             {'name': 'export', 'autorun': False}),
+            ({}, {}),
+        ])
+        # Before running, the preprocessor that runs with the build is used.
+        self.assertTrue(gci._get_preprocessor(pod).autorun)
+        main, export = reversed(pod.list_preprocessors())
+        main.run()
+        self.assertIs(main, gci._get_preprocessor(pod))
+        # Running on demand doesn't change the preprocessor used by templates.
+        export.run()
+        self.assertIs(main, gci._get_preprocessor(pod))
+        # A new instance (e.g. after editing the podspec) replaces it.
+        main = pod.list_preprocessors()[1]
+        main.run()
+        self.assertIs(main, gci._get_preprocessor(pod))
+
+    def test_find_image_references(self):
+        files = {
+            '/views/': {'page.html': (
+                "{{ google_image(doc.hero).url() }}"
+                "{{ google_image('/bucket/logo.png', fuzzy_extensions=True) }}")},
+            '/content/pages/': {'index.yaml': (
+                'hero: /other-bucket/hero@{locale}.jpg\n'
+                'icon: /static/icon.svg\n')},
+            '/static/': {'icon.svg': ''},
+        }
+        pod = self.create_pod(files)
+        self.assertEqual(
+            set([('/bucket/logo.png', True),
+                 ('/other-bucket/hero@{locale}.jpg', False)]),
+            pod.list_preprocessors()[0].find_image_references())
+
+    def test_snapshot_export_and_offline_import(self):
+        self.storage.add('/bucket/a.jpg')
+        self.storage.add('/bucket/placeholder.png')
+        files = {'/views/': {'page.html': (
+            "{{ google_image('/bucket/a.jpg').url() }} "
+            "{{ google_image('/bucket/b.png').url() }}")}}
+        placeholders = [gci.PlaceholderMessage(
+            extensions=['.png'], path='/bucket/placeholder.png')]
+        pod = self.create_pod(files, configs=[
+            ({'offline': True, 'import_snapshot': '/snapshot.json',
+              'placeholders': placeholders}, {}),
+            ({'export_snapshot': '/snapshot.json', 'placeholders': placeholders},
+             {'name': 'export', 'autorun': False}),
+        ])
+        main, export = pod.list_preprocessors()
+        # The export isn't affected by the main preprocessor being offline.
+        export.run()
+        with open(pod.abs_path('/snapshot.json')) as fp:
+            snapshot = json.load(fp)
+        self.assertEqual(2, len(snapshot['entries']))
+
+        # The placeholder fallback expires long before the snapshot is used.
+        for entry in snapshot['entries'].values():
+            if '_expires' in entry:
+                entry['_expires'] = 1
+        with open(pod.abs_path('/snapshot.json'), 'w') as fp:
+            json.dump(snapshot, fp)
+        pod.podcache.object_cache.reset()
+        requests = self.backend.requests
+        main.run()
+        html = self.render(pod, files['/views/']['page.html'])
+        self.assertEqual(2, len(html.split()))
+        self.assertEqual(requests, self.backend.requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
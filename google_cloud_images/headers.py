@@ -0,0 +1,13 @@
+"""HTTP headers shared by the extension and its backends."""
+
+# Set on every response (including errors) by backends that try the candidate
+# paths sent by clients. Backends deployed before candidates were supported
+# don't set it. Keep in sync with `VERSION_HEADER` in `backend/main.py`.
+VERSION_HEADER = 'X-Google-Cloud-Images-Version'
+# The version of the backend implemented by this package's local backend.
+BACKEND_VERSION = '2'
+
+
+def supports_candidates(headers):
+    """Returns whether the backend that sent `headers` tries candidates."""
+    return VERSION_HEADER in headers
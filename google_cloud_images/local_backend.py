@@ -0,0 +1,328 @@
+"""A local filesystem backend, for developing without the microservice.
+
+Maps `/bucket/path` to files within a local directory and generates the same
+data as the microservice. Images are served by a small local server, which
+implements a common subset of the image-serving options:
+
+- sN (longest side), wN (width), hN (height), c (crop to the dimensions),
+  s (stretch to the dimensions)
+- rj, rp, rw (JPEG, PNG or WebP format)
+- lN (quality)
+
+Transformed images are cached on disk. Requires Pillow.
+
+`LocalSession` has the same interface as the `requests.Session` used to call
+the microservice, so the rest of the extension works unchanged."""
+
+import datetime
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import socket
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from .headers import BACKEND_VERSION, VERSION_HEADER
+
+IMAGE_EXTENSIONS = ('.gif', '.jpeg', '.jpg', '.png', '.webp')
+FORMATS = {
+    'rj': ('JPEG', '.jpg'),
+    'rp': ('PNG', '.png'),
+    'rw': ('WEBP', '.webp'),
+}
+OPTION_RE = re.compile(r'^(s|w|h|l)(\d+)$')
+
+mimetypes.add_type('image/svg+xml', '.svg')
+mimetypes.add_type('image/webp', '.webp')
+
+# Servers started by this process, keyed by port. Grow may recreate the
+# preprocessor (e.g. when the podspec changes), which reuses the server.
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+class Error(Exception):
+    pass
+
+
+class LocalResponse(object):
+    """A response with the subset of the `requests.Response` interface used
+    by the extension."""
+
+    def __init__(self, url, status_code, data=None, etag=None):
+        self.url = url
+        self.status_code = status_code
+        self.headers = {VERSION_HEADER: BACKEND_VERSION}
+        self.elapsed = datetime.timedelta(0)
+        self.raw = None
+        self._data = data
+        if etag:
+            self.headers['ETag'] = '"{}"'.format(etag)
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        if self._data is None:
+            raise ValueError('No JSON body.')
+        return self._data
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise Error('Local backend error: {}'.format(self.status_code))
+
+
+class LocalSession(object):
+    """Resolves image data from the local filesystem."""
+
+    def __init__(self, root, server_url):
+        self.root = root
+        self.server_url = server_url.rstrip('/')
+
+    def _get_file_path(self, bucket_path):
+        path = os.path.normpath(os.path.join(self.root, bucket_path.lstrip('/')))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            return None
+        return path
+
+    def normalize(self, gs_path, locale):
+        """Returns the `/bucket/path` of the file to use for `gs_path`, using
+        the same locale fallbacks as the microservice."""
+        gs_path = '/{}'.format(gs_path.lstrip('/'))
+        candidates = [gs_path]
+        if '{locale}' in gs_path:
+            candidates = [gs_path.replace('{locale}', locale or '')]
+            if locale and '_' in locale:
+                territory = locale.split('_', 1)[1]
+                candidates.append(gs_path.replace('{locale}', '_{}'.format(territory)))
+            candidates.append(gs_path.replace('@{locale}', ''))
+        for candidate in candidates:
+            path = self._get_file_path(candidate)
+            if path and os.path.isfile(path):
+                return candidate
+        return None
+
+    def get_serving_data(self, bucket_path):
+        path = self._get_file_path(bucket_path)
+        stat = os.stat(path)
+        etag = hashlib.md5('{}:{}:{}'.format(
+            bucket_path, stat.st_mtime, stat.st_size).encode('utf-8')).hexdigest()
+        image_metadata = {}
+        if bucket_path.lower().endswith(IMAGE_EXTENSIONS):
+            try:
+                # Only the header is read to determine the size.
+                width, height = Image.open(path).size
+                image_metadata = {'width': width, 'height': height}
+            except IOError:
+                pass
+        return {
+            'content_type': mimetypes.guess_type(bucket_path)[0],
+            'created': stat.st_mtime,
+            'etag': etag,
+            'gs_path': bucket_path,
+            'image_metadata': image_metadata,
+            'metadata': {},
+            'size': stat.st_size,
+            'url': '{}{}'.format(self.server_url, bucket_path),
+        }
+
+    def resolve(self, candidates, locale):
+        """Returns `(index, bucket_path)` for the first of `candidates` that
+        exists, or `(None, None)`."""
+        for index, candidate in enumerate(candidates):
+            bucket_path = self.normalize(candidate, locale)
+            if bucket_path is not None:
+                return index, bucket_path
+        return None, None
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        params = params or {}
+        headers = headers or {}
+        candidates = [params.get('gs_path', '')] + list(params.get('candidate', []))
+        index, bucket_path = self.resolve(candidates, params.get('locale'))
+        if bucket_path is None:
+            return LocalResponse(url, 404)
+        data = self.get_serving_data(bucket_path)
+        if data['etag'] in headers.get('If-None-Match', ''):
+            return LocalResponse(url, 304, etag=data['etag'])
+        if len(candidates) > 1:
+            data['candidate'] = index
+        return LocalResponse(url, 200, data=data, etag=data['etag'])
+
+    def post(self, url, json=None, timeout=None):
+        results = []
+        for item in (json or {}).get('items', []):
+            candidates = [item.get('gs_path', '')] + (item.get('candidates') or [])
+            index, bucket_path = self.resolve(candidates, item.get('locale'))
+            if bucket_path is None:
+                results.append({'error': {'status': 404, 'detail': 'Not found.'}})
+                continue
+            data = self.get_serving_data(bucket_path)
+            if len(candidates) > 1:
+                data['candidate'] = index
+            results.append({'data': data})
+        return LocalResponse(url, 200, data={'results': results})
+
+
+def transform(source, dest, options):
+    """Writes the image at `source`, transformed according to `options`, to
+    `dest`."""
+    image = Image.open(source)
+    image_format = image.format
+    values = {}
+    crop = False
+    stretch = False
+    for option in options:
+        match = OPTION_RE.match(option)
+        if match:
+            values[match.group(1)] = int(match.group(2))
+        elif option == 'c':
+            crop = True
+        elif option == 's':
+            stretch = True
+        elif option in FORMATS:
+            image_format = FORMATS[option][0]
+        else:
+            raise Error('Unsupported option: {}'.format(option))
+    quality = values.pop('l', None)
+    width, height = image.size
+    if values.get('s'):
+        size = values['s']
+        if crop:
+            target = (size, size)
+        else:
+            scale = float(size) / max(width, height)
+            target = (int(round(width * scale)), int(round(height * scale)))
+    elif values.get('w') and values.get('h'):
+        if crop or stretch:
+            target = (values['w'], values['h'])
+        else:
+            scale = min(float(values['w']) / width, float(values['h']) / height)
+            target = (int(round(width * scale)), int(round(height * scale)))
+    elif values.get('w'):
+        target = (values['w'], int(round(height * float(values['w']) / width)))
+    elif values.get('h'):
+        target = (int(round(width * float(values['h']) / height)), values['h'])
+    else:
+        target = (width, height)
+    target = (max(1, target[0]), max(1, target[1]))
+    if target != (width, height):
+        if crop:
+            # Scale to cover the target, then crop from the center.
+            scale = max(float(target[0]) / width, float(target[1]) / height)
+            covered = (max(target[0], int(round(width * scale))),
+                       max(target[1], int(round(height * scale))))
+            image = image.resize(covered, Image.LANCZOS)
+            left = (covered[0] - target[0]) // 2
+            top = (covered[1] - target[1]) // 2
+            image = image.crop((left, top, left + target[0], top + target[1]))
+        else:
+            image = image.resize(target, Image.LANCZOS)
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    kwargs = {}
+    if quality and image_format in ('JPEG', 'WEBP'):
+        kwargs['quality'] = quality
+    image.save(dest, image_format, **kwargs)
+
+
+class LocalImageHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = unquote(self.path.split('?', 1)[0])
+        options = []
+        if '=' in path:
+            path, option_string = path.split('=', 1)
+            options = [option for option in option_string.split('-') if option]
+        source = self.server.session._get_file_path(path)
+        if not source or not os.path.isfile(source):
+            self.send_error(404)
+            return
+        content_type = mimetypes.guess_type(source)[0]
+        if options:
+            try:
+                source, content_type = self.server.get_transformed(source, options)
+            except Error as e:
+                self.send_error(400, str(e))
+                return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type or 'application/octet-stream')
+        self.send_header('Content-Length', str(os.path.getsize(source)))
+        self.end_headers()
+        with open(source, 'rb') as fp:
+            shutil.copyfileobj(fp, self.wfile)
+
+
+class LocalImageServer(ThreadingMixIn, HTTPServer):
+    """Serves local images, transformed according to the URL options."""
+    daemon_threads = True
+
+    def __init__(self, session, cache_dir, port):
+        HTTPServer.__init__(self, ('127.0.0.1', port), LocalImageHandler)
+        self.session = session
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+
+    def get_transformed(self, source, options):
+        stat = os.stat(source)
+        key = json.dumps([source, stat.st_mtime, stat.st_size, options])
+        ext = os.path.splitext(source)[1]
+        for option in options:
+            if option in FORMATS:
+                ext = FORMATS[option][1]
+        dest = os.path.join(
+            self.cache_dir, hashlib.md5(key.encode('utf-8')).hexdigest() + ext)
+        if not os.path.exists(dest):
+            with self._lock:
+                if not os.path.exists(dest):
+                    if not os.path.exists(self.cache_dir):
+                        os.makedirs(self.cache_dir)
+                    transform(source, dest + '.tmp', options)
+                    os.rename(dest + '.tmp', dest)
+        return dest, mimetypes.guess_type(dest)[0]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+def create_session(root, cache_dir, port):
+    """Returns a `LocalSession` for `root`, starting a server for its images
+    on `port` unless one is already running in this process."""
+    if Image is None:
+        raise Error('The local backend requires Pillow: pip install Pillow')
+    session = LocalSession(root, 'http://localhost:{}'.format(port))
+    with _servers_lock:
+        server = _servers.get(port)
+        if server is None:
+            try:
+                server = LocalImageServer(session, cache_dir, port).start()
+            except socket.error as e:
+                text = 'Unable to start the local image server on port {} ({})'
+                raise Error(text.format(port, e))
+            _servers[port] = server
+        server.session = session
+        server.cache_dir = cache_dir
+    return session
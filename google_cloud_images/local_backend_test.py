@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from google_cloud_images import local_backend
+from google_cloud_images.local_backend import Image
+
+
+@unittest.skipIf(Image is None, 'Requires Pillow.')
+class TransformTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.source = os.path.join(self.root, 'source.png')
+        Image.new('RGB', (200, 100)).save(self.source)
+
+    def assertSize(self, options, expected):
+        dest = os.path.join(self.root, 'dest.png')
+        local_backend.transform(self.source, dest, options)
+        self.assertEqual(expected, Image.open(dest).size)
+
+    def test_transform(self):
+        self.assertSize(['s100'], (100, 50))
+        self.assertSize(['s0'], (200, 100))
+        self.assertSize(['w50'], (50, 25))
+        self.assertSize(['h50'], (100, 50))
+        self.assertSize(['w50', 'h50'], (50, 25))
+        self.assertSize(['w50', 'h50', 'c'], (50, 50))
+        self.assertSize(['s100', 'c'], (100, 100))
+        # `s` without a value stretches the image to the dimensions.
+        self.assertSize(['s'], (200, 100))
+        self.assertSize(['w50', 'h50', 's'], (50, 50))
+
+    def test_unsupported_option(self):
+        with self.assertRaises(local_backend.Error):
+            local_backend.transform(
+                self.source, os.path.join(self.root, 'dest.png'), ['fv'])
+
+
+if __name__ == '__main__':
+    unittest.main()
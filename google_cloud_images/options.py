@@ -0,0 +1,89 @@
+"""Parses the options appended to image-serving URLs.
+
+Options are validated against the grammar documented in the README and put
+in a canonical order, so that equivalent lists of options (e.g. `['s500',
+'cc']` and `['cc', 's500']`) generate the same URL and share one cached
+rendition. The compiled suffix is memoized per list of options."""
+
+import re
+
+from . import errors
+
+# (kind, pattern) for each option, in canonical order. An option may only be
+# used once per kind.
+GRAMMAR = (
+    # Size and crop.
+    ('s', r's\d*'),
+    ('w', r'w\d+'),
+    ('h', r'h\d+'),
+    ('c', r'c'),
+    ('n', r'n'),
+    ('p', r'p'),
+    ('pp', r'pp'),
+    ('pa', r'pa'),
+    ('cc', r'cc'),
+    ('ci', r'ci'),
+    ('nu', r'nu'),
+    # Rotation.
+    ('fv', r'fv'),
+    ('fh', r'fh'),
+    ('r', r'r(?:90|180|270)'),
+    # Format.
+    ('format', r'r[gjpw]'),
+    ('v', r'v[0-3]'),
+    ('j', r'j\d+'),
+    ('l', r'l(?:100|[1-9]\d?)'),
+    # Animated GIF.
+    ('rh', r'rh'),
+    ('k', r'k'),
+    # Miscellaneous.
+    ('b', r'b\d+'),
+    ('br', r'br\d+'),
+    ('border_color', r'c0x[0-9a-fA-F]{8}'),
+    ('d', r'd'),
+    ('e', r'e\d+'),
+    ('html', r'h'),
+    ('g', r'g'),
+)
+
+_RULES = [(kind, re.compile(r'^(?:{})$'.format(pattern)))
+          for kind, pattern in GRAMMAR]
+_suffixes = {}
+
+
+class Error(errors.Error):
+    pass
+
+
+def parse(option):
+    """Returns `(rank, kind)` for an option, where `rank` is its position in
+    the canonical order."""
+    for rank, (kind, pattern) in enumerate(_RULES):
+        if pattern.match(option):
+            return rank, kind
+    raise Error('Invalid Google Cloud Images option -> {}'.format(option))
+
+
+def canonicalize(options):
+    """Returns a list of validated `options` in canonical order, without
+    duplicates. Items may contain several options joined by `-`."""
+    parsed = {}
+    for item in options:
+        for option in item.split('-'):
+            rank, kind = parse(option)
+            if kind in parsed and parsed[kind][1] != option:
+                text = 'Conflicting Google Cloud Images options -> {}, {}'
+                raise Error(text.format(parsed[kind][1], option))
+            parsed[kind] = (rank, option)
+    return [option for _, option in sorted(parsed.values())]
+
+
+def compile_options(options):
+    """Returns the URL suffix for `options`."""
+    if isinstance(options, (str, type(u''))):
+        options = [options]
+    key = tuple(options)
+    suffix = _suffixes.get(key)
+    if suffix is None:
+        suffix = _suffixes[key] = '-'.join(canonicalize(key))
+    return suffix
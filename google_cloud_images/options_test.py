@@ -0,0 +1,71 @@
+import os
+import re
+import unittest
+
+from google_cloud_images import google_cloud_images
+from google_cloud_images import options
+
+README_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'README.md')
+
+
+class OptionsTestCase(unittest.TestCase):
+
+    def test_canonicalize(self):
+        self.assertEqual(['s500', 'cc'], options.canonicalize(['cc', 's500']))
+        self.assertEqual(['w100', 'h50', 'c', 'rw', 'l90'],
+                         options.canonicalize(['l90-rw', 'c', 'h50', 'w100']))
+        # Duplicates are removed.
+        self.assertEqual(['s500'], options.canonicalize(['s500', 's500']))
+        # `s` alone serves the original size.
+        self.assertEqual(['s'], options.canonicalize(['s']))
+
+    def test_canonicalize_errors(self):
+        for invalid in ['x', 's500x', 'r45', 'l0', 'l101', 'v4', '']:
+            with self.assertRaises(options.Error):
+                options.canonicalize([invalid])
+        with self.assertRaises(options.Error):
+            options.canonicalize(['s500', 's800'])
+        with self.assertRaises(options.Error):
+            options.canonicalize(['rj-rw'])
+
+    def test_readme_examples(self):
+        with open(README_PATH) as fp:
+            readme = fp.read()
+        # The live examples, e.g. `pp-br100-rp-s200`.
+        examples = re.findall(r'googleusercontent\.com/[\w-]+=([\w-]+)\)', readme)
+        self.assertEqual(4, len(examples))
+        # The documented options.
+        examples += [
+            's640', 's0', 'w100', 'h100', 's', 'c', 'n', 'p', 'pp', 'pa', 'cc',
+            'ci', 'nu', 'fv', 'fh', 'r90', 'r180', 'r270', 'rj', 'rp', 'rw',
+            'rg', 'v0', 'v3', 'j80', 'rh', 'k', 'b10', 'br100', 'c0xffff0000',
+            'd', 'e7', 'l100', 'h', 'g',
+        ]
+        for example in examples:
+            self.assertEqual(sorted(example.split('-')),
+                             sorted(options.compile_options(example).split('-')))
+
+    def test_error(self):
+        # Handled along with the extension's other errors.
+        self.assertTrue(issubclass(options.Error, google_cloud_images.Error))
+
+    def test_parse(self):
+        # Rotation and format options share a prefix.
+        self.assertEqual('r', options.parse('r90')[1])
+        self.assertEqual('format', options.parse('rj')[1])
+        self.assertEqual('border_color', options.parse('c0xff00ff00')[1])
+        self.assertEqual('html', options.parse('h')[1])
+        self.assertEqual('h', options.parse('h300')[1])
+
+    def test_compile_options(self):
+        self.assertEqual('s500-cc', options.compile_options(['cc', 's500']))
+        self.assertEqual('s500-cc', options.compile_options(['s500-cc']))
+        self.assertEqual('rw', options.compile_options('rw'))
+        self.assertEqual('', options.compile_options([]))
+        self.assertEqual(options.compile_options(['cc', 's500']),
+                         options.compile_options(['s500', 'cc']))
+
+
+if __name__ == '__main__':
+    unittest.main()
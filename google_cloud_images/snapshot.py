@@ -0,0 +1,61 @@
+"""Exports and imports snapshots of resolved image data.
+
+A snapshot contains the cached data for the images a pod references, so that
+it can be resolved once and shipped to machines (such as CI runners) that
+start with an empty cache or can't reach the backend. Keys are stored without
+the backend URL, so snapshots can be imported for a different backend URL."""
+
+import json
+
+from . import cache_store
+
+VERSION = 1
+
+
+def _relative_key(key, prefix):
+    return key[len(prefix):] if key.startswith(prefix) else None
+
+
+def export_snapshot(preprocessor, images, path):
+    """Writes the cached data for `images` to the file at `path`. Returns
+    the number of entries written."""
+    prefix = '{}:'.format(preprocessor.backend)
+    cache = preprocessor.cache
+    entries = {}
+    for image in images:
+        key = image._cache_key
+        entry = cache.get(key)
+        if entry is None:
+            continue
+        entry = cache_store.compact(entry)
+        if '_alias' in entry:
+            target = cache.get(entry['_alias'])
+            if target is None:
+                continue
+            target_key = _relative_key(entry['_alias'], prefix)
+            entries[target_key] = cache_store.compact(target)
+            entry['_alias'] = target_key
+        entries[_relative_key(key, prefix)] = entry
+    with open(path, 'w') as fp:
+        json.dump({'version': VERSION, 'entries': entries}, fp,
+                  separators=(',', ':'), sort_keys=True)
+    return len(entries)
+
+
+def import_snapshot(preprocessor, path):
+    """Adds the entries of the snapshot at `path` to the cache. Returns the
+    number of entries imported."""
+    with open(path) as fp:
+        snapshot = json.load(fp)
+    if snapshot.get('version') != VERSION:
+        raise ValueError('Unsupported snapshot version: {}'.format(
+            snapshot.get('version')))
+    prefix = '{}:'.format(preprocessor.backend)
+    entries = {}
+    for key, entry in snapshot['entries'].items():
+        if '_alias' in entry:
+            entry = dict(entry)
+            entry['_alias'] = prefix + entry['_alias']
+        entries[prefix + key] = entry
+    preprocessor.cache.add_all(entries)
+    return len(entries)
@@ -0,0 +1,92 @@
+"""Collects statistics about image resolution during a build."""
+
+import bisect
+import collections
+import heapq
+import json
+import threading
+
+# Upper bounds (in seconds) of the backend latency histogram buckets.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+
+
+def get_page():
+    """Returns the page currently being rendered by this thread."""
+    return getattr(_local, 'page', None)
+
+
+def set_page(page):
+    _local.page = page
+
+
+class Stats(object):
+
+    def __init__(self, max_entries=20):
+        self._lock = threading.Lock()
+        self._max_entries = max_entries
+        self.counters = collections.Counter()
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.page_waits = collections.Counter()
+        self._slowest = []
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def record_call(self, path, seconds, retries=0):
+        """Records a request to the backend."""
+        with self._lock:
+            self.counters['backend_calls'] += 1
+            self.counters['retries'] += retries
+            self.histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            item = (seconds, path)
+            if len(self._slowest) < self._max_entries:
+                heapq.heappush(self._slowest, item)
+            else:
+                heapq.heappushpop(self._slowest, item)
+
+    def record_wait(self, seconds, page=None):
+        """Records time spent waiting for image data while rendering."""
+        page = page or get_page()
+        if page is None:
+            return
+        with self._lock:
+            self.page_waits[page] += seconds
+
+    def to_dict(self):
+        with self._lock:
+            labels = ['<={}s'.format(bound) for bound in LATENCY_BUCKETS]
+            labels.append('>{}s'.format(LATENCY_BUCKETS[-1]))
+            return {
+                'counters': dict(self.counters),
+                'latency_histogram': collections.OrderedDict(
+                    zip(labels, self.histogram)),
+                'slowest_paths': [
+                    {'path': path, 'seconds': round(seconds, 3)}
+                    for seconds, path in sorted(self._slowest, reverse=True)],
+                'slowest_pages': [
+                    {'page': page, 'seconds': round(seconds, 3)}
+                    for page, seconds in self.page_waits.most_common(
+                        self._max_entries)],
+            }
+
+    def summary(self):
+        data = self.to_dict()
+        counters = data['counters']
+        lines = ['Google Cloud Images report:']
+        for name in sorted(counters):
+            lines.append('  {}: {}'.format(name, counters[name]))
+        for item in data['slowest_paths'][:5]:
+            lines.append('  slow path: {path} ({seconds}s)'.format(**item))
+        for item in data['slowest_pages'][:5]:
+            lines.append('  slow page: {page} ({seconds}s)'.format(**item))
+        return '\n'.join(lines)
+
+    def write(self, path):
+        with open(path, 'w') as fp:
+            if path.endswith('.txt'):
+                fp.write(self.summary() + '\n')
+            else:
+                json.dump(self.to_dict(), fp, indent=2)